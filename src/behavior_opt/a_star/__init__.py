@@ -1,3 +1,4 @@
+from behavior_opt.a_star.grid_graph import *
 from behavior_opt.a_star.planning import *
 from behavior_opt.a_star.push_and_swap import *
 from behavior_opt.a_star.task_assignment import *
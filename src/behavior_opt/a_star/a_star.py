@@ -1,30 +1,23 @@
-import networkx as nx
-from networkx import Graph
 from dataclasses import dataclass
 from copy import deepcopy
+from behavior_opt.a_star.grid_graph import GridGraph, PathOracle
+from behavior_opt.a_star.rolling_horizon import RollingHorizonPlanner
 from behavior_opt.a_star.task_assignment import ManuallyTaskAssignment
 from behavior_opt.sh_core import World, Task, Item, StorePoint, Objective
 from pathlib import Path
 from behavior_opt.utils.file_io import (
     read_agent_config,
+    read_compiled_map,
     read_item_config,
     read_map_config,
     read_picking_list,
 )
+from behavior_opt.utils.validation import find_conflicts, read_trajectory, summarize
 import csv
 import argparse
 import time
 
 
-def create_graph(map_):
-    G: Graph = nx.grid_2d_graph(map_.shape[0], map_.shape[1])
-    for i in range(map_.shape[0]):
-        for j in range(map_.shape[1]):
-            if map_[i, j] == 1:
-                G.remove_node((i, j))  # type: ignore
-    return G
-
-
 @dataclass
 class Output:
     path: list
@@ -32,26 +25,39 @@ class Output:
     item: Item
 
 
+# タスク割り当てCSVのaction列
+TASK_ACTIONS = {
+    "PICK_UP": Objective.PICK_UP,
+    "DROP_OFF": Objective.DROP_OFF,
+    "DOCK": Objective.DOCK,
+}
+
+
 def read_task_assignment(file_path: str, world: World):
-    with open(file_path, "r") as f:
-        lines = f.readlines()
+    # アイテム名から最初のタスクを引く (world.tasks[name]と同じ)
+    task_index: dict[str, Task] = {}
+    for task in world.tasks:
+        task_index.setdefault(task.item.name, task)
+    item_names = set(world.items.names)
     agent_list = []
     task_list = []
     action_list = []
-    for line in lines[1:]:
-        agent_id, item_name, row, col, action = line.strip().split(",")
-        agent_list.append(agent_id)
-        items = deepcopy(world.items)
-        item = items.pop(item_name)
-
-        task_list.append(world.tasks[item])
-        if action == "PICK_UP":
-            action = Objective.PICK_UP
-        elif action == "DOCK":
-            action = Objective.DOCK
-        elif action == "DROP_OFF":
-            action = Objective.DROP_OFF
-        action_list.append(action)
+    with open(file_path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for line_no, line in enumerate(reader, start=2):
+            if not line:
+                continue
+            agent_id, item_name, row, col, action = (value.strip() for value in line)
+            if item_name not in item_names:
+                raise ValueError(f"unknown item: {item_name} (line {line_no})")
+            if item_name not in task_index:
+                raise ValueError(f"no task for item: {item_name} (line {line_no})")
+            if action not in TASK_ACTIONS:
+                raise ValueError(f"unknown action: {action} (line {line_no})")
+            agent_list.append(agent_id)
+            task_list.append(task_index[item_name])
+            action_list.append(TASK_ACTIONS[action])
     return agent_list, task_list, action_list
 
 
@@ -103,6 +109,8 @@ def planning(
     item_config_path: Path,
     picking_list_path: Path,
     task_assignment_path: Path,
+    horizon: int | None = None,
+    window: int = 5,
 ):
     if config_path is None or item_config_path is None:
         # map_config_pathはjsonのみ
@@ -119,6 +127,7 @@ def planning(
         picking_list=picking_list,
         agent_configs=agent_config,
         item_configs=item_config,
+        compiled_map=read_compiled_map(map_config_path),
     )
     copy_world = deepcopy(world)
     agent_list, task_list, action_list = read_task_assignment(
@@ -126,42 +135,57 @@ def planning(
     )
     current_agents = copy_world.agents
     plain_map = copy_world.plain_map
-    graph_map = create_graph(plain_map)
+    graph_map = GridGraph.from_map(plain_map)
+    # 経路は棚の取り出し口や出荷口などの同じ端点の間を何度も往復する
+    path_oracle = PathOracle(graph_map)
     task_assignment = ManuallyTaskAssignment(copy_world)
     task_assignment.assign(agent_list, task_list, action_list)
     action_output = {i.name: [] for i in world.agents}
-    while True:
-        for agent_id, agent in enumerate(current_agents):
-            actions = task_assignment.actions[agent.name]
-            if len(actions) == 1 and agent.pos == agent.goal.pos:
-                del task_assignment.actions[agent.name]
-                del task_assignment.assigned_tasks[agent.name]
-                current_agents.remove(agent)
-        if len(current_agents) == 0:
-            break
-        task_assignment.set_target()
-
-        for agent_id, agent in enumerate(current_agents):
-            start = agent.pos
-            target = agent.target
-            path = nx.shortest_path(graph_map, tuple(start), tuple(target))
-            agent.pos = target
-            agent.target = None
-            if task_assignment.current_task[agent.name] is None:
-                item = None
-            else:
-                item = task_assignment.current_task[agent.name].item
-            assert (
-                path[0] == action_output[agent.name][-1].path[-1]
-                if action_output[agent.name]
-                else agent.pos
-            ), path
-            output = Output(
-                path=path,
-                action=task_assignment.current_action[agent.name],
-                item=item,
-            )
-            action_output[agent.name].append(output)
+    if horizon is not None:
+        # 他のエージェントとの衝突を予約表で避けながら、windowステップごとに計画し直す
+        planner = RollingHorizonPlanner(
+            graph_map,
+            task_assignment,
+            current_agents,
+            window=window,
+            horizon=horizon,
+            path_oracle=path_oracle,
+        )
+        for agent_name, legs in planner.run().items():
+            action_output[agent_name] = [Output(*leg) for leg in legs]
+    else:
+        while True:
+            for agent_id, agent in enumerate(current_agents):
+                actions = task_assignment.actions[agent.name]
+                if len(actions) == 1 and agent.pos == agent.goal.pos:
+                    del task_assignment.actions[agent.name]
+                    del task_assignment.assigned_tasks[agent.name]
+                    current_agents.remove(agent)
+            if len(current_agents) == 0:
+                break
+            task_assignment.set_target()
+
+            for agent_id, agent in enumerate(current_agents):
+                start = agent.pos
+                target = agent.target
+                path = path_oracle.shortest_path(start, target)
+                agent.pos = target
+                agent.target = None
+                if task_assignment.current_task[agent.name] is None:
+                    item = None
+                else:
+                    item = task_assignment.current_task[agent.name].item
+                assert (
+                    path[0] == action_output[agent.name][-1].path[-1]
+                    if action_output[agent.name]
+                    else agent.pos
+                ), path
+                output = Output(
+                    path=path,
+                    action=task_assignment.current_action[agent.name],
+                    item=item,
+                )
+                action_output[agent.name].append(output)
     result = {agent.name: None for agent in world.agents}
     for agent_id, agent in enumerate(world.agents):
         output_list = action_output[agent.name]
@@ -206,6 +230,9 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--picking-list-path", required=True, type=Path)
     parser.add_argument("-ta", "--task-assignment-path", required=True, type=Path)
     parser.add_argument("-o", "--output-dir", required=True, type=Path)
+    # horizonを指定すると衝突を避けるrolling-horizonで計画する
+    parser.add_argument("-H", "--horizon", required=False, type=int)
+    parser.add_argument("-w", "--window", default=5, type=int)
     args = parser.parse_args()
     map_config_path: Path = args.map_config_path
     config_path = args.config_path
@@ -214,6 +241,8 @@ if __name__ == "__main__":
     picking_list_path: Path = args.picking_list_path
     task_assignment_path: Path = args.task_assignment_path
     output_dir_path: Path = args.output_dir
+    horizon: int | None = args.horizon
+    window: int = args.window
 
     output_dir_path.mkdir(exist_ok=True, parents=True)
     start_time = time.time()
@@ -224,6 +253,8 @@ if __name__ == "__main__":
         item_config_path,
         picking_list_path,
         task_assignment_path,
+        horizon=horizon,
+        window=window,
     )
 
     write_output_csv(output_dir_path / "output.csv", result)
@@ -236,5 +267,8 @@ if __name__ == "__main__":
     print(f"elapsed_time:{elapsed_time}")
     print(f"makespan:{makespan}")
     print(f"avg steps:{avg_steps}")
+    # horizonを指定しない場合は衝突を考慮しない計画なので、違反は止めずに件数だけ出す
+    _, trajectory = read_trajectory(output_dir_path / "output.csv")
+    print(f"conflicts:{summarize(find_conflicts(trajectory))}")
     for i, path in enumerate([i["path"] for i in result.values()]):
         print(f"agent:{i} steps:{len(path)}")
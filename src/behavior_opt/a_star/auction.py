@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import numpy as np
+from numpy.typing import NDArray
+
+# 入札の最小の上げ幅 (最適な割り当てとの差は人数 * AUCTION_EPS以内)
+AUCTION_EPS = 1.0
+# 割り当てないことを表す値
+UNASSIGNED = -1
+
+
+def auction(benefit: NDArray[np.float64], eps: float = AUCTION_EPS) -> NDArray[np.int64]:
+    """オークション法 (Bertsekas) で、各人に1つずつ物を割り当てる (benefitの合計をほぼ最大化)
+
+    benefit[i, j]は人iが物jを得たときの利益で、-infは割り当てられないことを表す。
+    人が物より多い場合や、取り合いで割に合わなくなった人には割り当てない (UNASSIGNED)。
+    利益の行が同じ人 (同じ位置にいるエージェントなど) は1つのグループとしてまとめて入札する。
+    戻り値は各人に割り当てた物の番号。
+    """
+    n_persons, n_objects = benefit.shape
+    assigned = np.full(n_persons, UNASSIGNED, dtype=np.int64)
+    if n_persons == 0 or n_objects == 0:
+        return assigned
+    if n_objects > n_persons:
+        # 他の人が取れるのはn_persons - 1個までなので、各人の上位n_persons個だけを候補にしても
+        # 最適な割り当ては変わらない (同じ位置のエージェントが多いと候補がずっと少なくなる)
+        top = np.argpartition(-benefit, n_persons - 1, axis=1)[:, :n_persons]
+        candidates = np.unique(top)
+        if len(candidates) < n_objects:
+            assigned = auction(benefit[:, candidates], eps)
+            return np.where(assigned == UNASSIGNED, UNASSIGNED, candidates[assigned])
+    rows, group_of, demand = _group_rows(benefit)
+    owner = _group_auction(rows, demand, eps)
+    # 各グループが得た物を、そのグループの人に番号順に配る
+    objects = np.flatnonzero(owner != UNASSIGNED)
+    objects = objects[np.argsort(owner[objects], kind="stable")]
+    groups = owner[objects]
+    persons = np.argsort(group_of.ravel(), kind="stable")
+    group_start = np.r_[0, np.cumsum(demand)[:-1]]
+    rank = np.arange(len(objects)) - np.searchsorted(groups, groups)
+    assigned[persons[group_start[groups] + rank]] = objects
+    return assigned
+
+
+def _group_rows(
+    benefit: NDArray[np.float64],
+) -> tuple[NDArray[np.float64], NDArray[np.int64], NDArray[np.int64]]:
+    """同じ行をまとめる (np.unique(axis=0)と同じ (行, 各行のグループ, グループの大きさ))
+
+    行を乱数のベクトルとの内積で1つの値にしてまとめ、まとめた結果が正しいか確かめる。
+    np.unique(axis=0)は行を辞書順に並べるので遅い。
+    """
+    projection = np.random.default_rng(0).random(benefit.shape[1])
+    keys = np.where(np.isfinite(benefit), benefit, -1.0) @ projection
+    _, first, group_of, demand = np.unique(
+        keys, return_index=True, return_inverse=True, return_counts=True
+    )
+    rows = benefit[first]
+    if not np.array_equal(rows[group_of], benefit):
+        return np.unique(benefit, axis=0, return_inverse=True, return_counts=True)
+    return rows, group_of, demand
+
+
+def _group_auction(
+    benefit: NDArray[np.float64], demand: NDArray[np.int64], eps: float
+) -> NDArray[np.int64]:
+    """グループgがdemand[g]個まで物を得るオークション。各物を得たグループの番号を返す
+
+    割り当てが足りないグループがまとめて入札し、物ごとに最も高い入札が勝つ (Jacobi版) ので、
+    1ラウンドは配列演算だけで済む。k個足りないグループは、持っていない物のうち上位k個に、
+    k + 1番目との差だけ値段を上げて入札する。
+    """
+    n_groups, n_objects = benefit.shape
+    owner = np.full(n_objects, UNASSIGNED, dtype=np.int64)
+    finite = np.isfinite(benefit)
+    if not finite.any():
+        return owner
+    # 「割り当てなし」の利益。値段0のどの物よりも低く、取り合いで値段が利益の幅より
+    # 上がった物しか残っていないグループはこれを選んで入札をやめる
+    lowest, highest = benefit[finite].min(), benefit[finite].max()
+    no_object = lowest - (highest - lowest) - eps
+    prices = np.zeros(n_objects)
+    held = np.zeros(n_groups, dtype=np.int64)
+    bidding = finite.any(axis=1)
+    while True:
+        bidders = np.flatnonzero(bidding & (held < demand))
+        if len(bidders) == 0:
+            break
+        need = demand[bidders] - held[bidders]
+        values = benefit[bidders] - prices
+        values[owner == bidders[:, np.newaxis]] = -np.inf
+        # 上位need + 1個を値の大きい順に並べる
+        n_top = min(int(need.max()) + 1, n_objects)
+        if n_top < n_objects:
+            top = np.argpartition(-values, n_top - 1, axis=1)[:, :n_top]
+        else:
+            top = np.broadcast_to(np.arange(n_objects), values.shape)
+        top_values = np.take_along_axis(values, top, axis=1)
+        order = np.argsort(-top_values, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_values = np.take_along_axis(top_values, order, axis=1)
+        # need + 1番目 (なければ「割り当てなし」) との差だけ値段を上げる
+        padded = np.concatenate([top_values, np.full((len(bidders), 1), no_object)], axis=1)
+        next_value = np.maximum(padded[np.arange(len(bidders)), np.minimum(need, n_top)], no_object)
+        slots = (np.arange(n_top) < need[:, np.newaxis]) & (top_values > no_object)
+        # 「割り当てなし」が一番よいグループは入札をやめる
+        bidding[bidders[~slots.any(axis=1)]] = False
+        slot_rows, slot_cols = np.nonzero(slots)
+        if len(slot_rows) == 0:
+            continue
+        groups = bidders[slot_rows]
+        objects = top[slot_rows, slot_cols]
+        bids = prices[objects] + top_values[slot_rows, slot_cols] - next_value[slot_rows] + eps
+        # 物ごとに最も高い入札 (同じならグループの番号の小さいほう) を勝ちにする
+        order = np.lexsort((groups, -bids, objects))
+        won = order[np.r_[True, objects[order][1:] != objects[order][:-1]]]
+        objects, groups = objects[won], groups[won]
+        outbid = owner[objects]
+        np.subtract.at(held, outbid[outbid != UNASSIGNED], 1)
+        owner[objects] = groups
+        prices[objects] = bids[won]
+        np.add.at(held, groups, 1)
+    return owner
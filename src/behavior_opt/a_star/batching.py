@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+from collections import deque
+
+import numpy as np
+from numpy.typing import NDArray
+
+# 各タスクについて節約量や改善を試す、取り出し口の近いタスクの数
+N_NEIGHBORS = 10
+# 近傍を求めるときに、距離表を何行ずつ作るか
+CHUNK_ROWS = 1024
+
+
+def nearest_tasks(
+    picks: NDArray[np.int64],
+    drops: NDArray[np.int64],
+    dists: NDArray[np.uint16],
+    k: int = N_NEIGHBORS,
+) -> NDArray[np.int64]:
+    """(タスク数, k)の表: 降ろし先が同じタスクのうち、取り出し口が近い順のタスク番号 (足りなければ-1)"""
+    n = len(picks)
+    neighbors = np.full((n, k), -1, dtype=np.int64)
+    for drop in np.unique(drops):
+        group = np.flatnonzero(drops == drop)
+        n_cols = min(k, len(group) - 1)
+        if n_cols == 0:
+            continue
+        for start in range(0, len(group), CHUNK_ROWS):
+            rows = group[start : start + CHUNK_ROWS]
+            block = dists[np.ix_(picks[rows], picks[group])].astype(np.int64)
+            # 自分自身は選ばない
+            block[np.arange(len(rows)), np.arange(start, start + len(rows))] = np.iinfo(np.int64).max
+            nearest = np.argpartition(block, n_cols - 1, axis=1)[:, :n_cols]
+            # 同じ距離ならタスク番号の小さい順にする
+            order = np.lexsort((nearest, np.take_along_axis(block, nearest, axis=1)), axis=1)
+            neighbors[rows, :n_cols] = group[np.take_along_axis(nearest, order, axis=1)]
+    return neighbors
+
+
+def savings_routes(
+    picks: NDArray[np.int64],
+    drops: NDArray[np.int64],
+    volumes: NDArray[np.int64],
+    capacity: int,
+    dists: NDArray[np.uint16],
+    neighbors: NDArray[np.int64],
+) -> list[list[int]]:
+    """節約法 (Clarke-Wright) でタスクを容量capacity以内のルートにまとめる
+
+    ルートは降ろし先dropから出て取り出し口を順に回り、dropに戻る。
+    タスクi, jを繋ぐ節約量はd(drop, i) + d(drop, j) - d(i, j)で、近傍の組だけを大きい順に試す。
+    """
+    n = len(picks)
+    i_ids = np.repeat(np.arange(n), neighbors.shape[1])
+    j_ids = neighbors.ravel()
+    valid = j_ids >= 0
+    i_ids, j_ids = i_ids[valid], j_ids[valid]
+    to_drop = dists[drops, picks].astype(np.int64)
+    savings = to_drop[i_ids] + to_drop[j_ids] - dists[picks[i_ids], picks[j_ids]]
+    order = np.lexsort((j_ids, i_ids, -savings))
+    order = order[savings[order] > 0]
+
+    # 各ルートは双方向の連結リストで持ち、小さいほうのルートを大きいほうに繋ぐ
+    route_of = list(range(n))
+    members = [[i] for i in range(n)]
+    head = list(range(n))
+    tail = list(range(n))
+    load = volumes.tolist()
+    nxt = [-1] * n
+    prv = [-1] * n
+
+    def reverse(route: int) -> None:
+        for t in members[route]:
+            nxt[t], prv[t] = prv[t], nxt[t]
+        head[route], tail[route] = tail[route], head[route]
+
+    for i, j in zip(i_ids[order].tolist(), j_ids[order].tolist()):
+        a, b = route_of[i], route_of[j]
+        if a == b or load[a] + load[b] > capacity:
+            continue
+        if i != head[a] and i != tail[a] or j != head[b] and j != tail[b]:
+            continue
+        if len(members[a]) < len(members[b]):
+            a, b, i, j = b, a, j, i
+        if i == tail[a]:
+            # a ... i → j ... b
+            if j != head[b]:
+                reverse(b)
+            nxt[i], prv[j] = j, i
+            tail[a] = tail[b]
+        else:
+            # b ... j → i ... a
+            if j != tail[b]:
+                reverse(b)
+            nxt[j], prv[i] = i, j
+            head[a] = head[b]
+        for t in members[b]:
+            route_of[t] = a
+        members[a].extend(members[b])
+        members[b] = []
+        load[a] += load[b]
+
+    routes: list[list[int]] = []
+    for route in range(n):
+        if not members[route]:
+            continue
+        t = head[route]
+        tour = []
+        while t >= 0:
+            tour.append(t)
+            t = nxt[t]
+        routes.append(tour)
+    return routes
+
+
+def improve_routes(
+    routes: list[list[int]],
+    picks: NDArray[np.int64],
+    drops: NDArray[np.int64],
+    volumes: NDArray[np.int64],
+    capacity: int,
+    dists: NDArray[np.uint16],
+    neighbors: NDArray[np.int64],
+) -> list[list[int]]:
+    """2-optとrelocateの局所探索でルートの総距離を減らす (空になったルートは除く)
+
+    どちらの近傍も、取り出し口が近いタスクとの間で張り替える辺だけを見るので、
+    1回の評価は定数時間。改善したタスクの周りだけをキューに戻して、改善がなくなるまで続ける。
+    """
+    d = dists.item
+    route_of = [0] * len(picks)
+    index_of = [0] * len(picks)
+    load = [0] * len(routes)
+    for r, route in enumerate(routes):
+        for x, t in enumerate(route):
+            route_of[t], index_of[t] = r, x
+        load[r] = int(volumes[route].sum())
+    depot = [int(drops[route[0]]) for route in routes]
+    picks_list = picks.tolist()
+    volumes_list = volumes.tolist()
+    neighbor_list = [[j for j in row if j >= 0] for row in neighbors.tolist()]
+
+    def node(r: int, x: int) -> int:
+        """ルートrのx番目の地点 (-1と末尾の次は降ろし先)"""
+        if x < 0 or x >= len(routes[r]):
+            return depot[r]
+        return picks_list[routes[r][x]]
+
+    def reindex(r: int, start: int, stop: int) -> None:
+        route = routes[r]
+        for x in range(start, min(stop, len(route))):
+            route_of[route[x]], index_of[route[x]] = r, x
+
+    def two_opt(t: int) -> int | None:
+        """tと近傍の間の2-opt (ルート内の区間の反転)。改善したら動いたタスクを返す"""
+        r, x = route_of[t], index_of[t]
+        for c in neighbor_list[t]:
+            if route_of[c] != r:
+                continue
+            y = index_of[c]
+            # (t, tの次), (c, cの次)を(t, c), (tの次, cの次)に、または前側で同様に張り替える
+            for lo, hi in ((min(x, y), max(x, y)), (min(x, y) - 1, max(x, y) - 1)):
+                if hi - lo < 2:
+                    continue
+                a, b, e, f = node(r, lo), node(r, lo + 1), node(r, hi), node(r, hi + 1)
+                if d(a, e) + d(b, f) < d(a, b) + d(e, f):
+                    routes[r][lo + 1 : hi + 1] = routes[r][lo + 1 : hi + 1][::-1]
+                    reindex(r, lo + 1, hi + 1)
+                    return c
+        return None
+
+    def relocate(t: int) -> int | None:
+        """tを近傍の前後に移す (別のルートへも)。改善したら移した先の近傍を返す"""
+        r, x = route_of[t], index_of[t]
+        prev_node, t_node, next_node = node(r, x - 1), picks_list[t], node(r, x + 1)
+        gain = d(prev_node, t_node) + d(t_node, next_node) - d(prev_node, next_node)
+        for c in neighbor_list[t]:
+            s = route_of[c]
+            if s != r and load[s] + volumes_list[t] > capacity:
+                continue
+            y = index_of[c]
+            for at in (y, y + 1):
+                # tの隣への挿入は位置が変わらない
+                if s == r and at in (x, x + 1):
+                    continue
+                u, v = node(s, at - 1), node(s, at)
+                if d(u, t_node) + d(t_node, v) - d(u, v) < gain:
+                    del routes[r][x]
+                    load[r] -= volumes_list[t]
+                    if s == r and at > x:
+                        at -= 1
+                    routes[s].insert(at, t)
+                    load[s] += volumes_list[t]
+                    if s == r:
+                        reindex(r, min(x, at), len(routes[r]))
+                    else:
+                        reindex(r, x, len(routes[r]))
+                        reindex(s, at, len(routes[s]))
+                    return c
+        return None
+
+    queue = deque(range(len(picks)))
+    queued = [True] * len(picks)
+    while queue:
+        t = queue.popleft()
+        queued[t] = False
+        moved = two_opt(t)
+        if moved is None:
+            moved = relocate(t)
+        if moved is None:
+            continue
+        for u in (t, moved, *neighbor_list[t], *neighbor_list[moved]):
+            if not queued[u]:
+                queued[u] = True
+                queue.append(u)
+    return [route for route in routes if route]
+
+
+def build_batches(
+    picks: NDArray[np.int64],
+    drops: NDArray[np.int64],
+    volumes: NDArray[np.int64],
+    capacity: int,
+    dists: NDArray[np.uint16],
+) -> list[list[int]]:
+    """タスクを、容量capacity以内で同じ降ろし先に向かうバッチにまとめる
+
+    picks, dropsは各タスクの取り出し口と降ろし先のdistsでの番号、volumesはアイテムの容量。
+    バッチはタスク番号を取り出す順に並べたもの。
+    """
+    if len(picks) == 0:
+        return []
+    if volumes.max() > capacity:
+        raise ValueError(f"item volume {volumes.max()} exceeds capacity {capacity}")
+    neighbors = nearest_tasks(picks, drops, dists)
+    routes = savings_routes(picks, drops, volumes, capacity, dists, neighbors)
+    return improve_routes(routes, picks, drops, volumes, capacity, dists, neighbors)
+
+
+def route_length(route: list[int], picks: NDArray[np.int64], dists: NDArray[np.uint16]) -> int:
+    """取り出し口を順に回る距離 (降ろし先との往復は含まない)"""
+    nodes = picks[route]
+    return int(dists[nodes[:-1], nodes[1:]].astype(np.int64).sum())
+
+
+def split_route(route: list[int], volumes: NDArray[np.int64], capacity: int) -> list[list[int]]:
+    """routeを回る順のまま、volumeの合計がcapacity以内の区間 (1往復で回る分) に分ける"""
+    trips: list[list[int]] = [[]]
+    load = 0
+    for t in route:
+        volume = int(volumes[t])
+        if volume > capacity:
+            raise ValueError(f"item volume {volume} exceeds capacity {capacity}")
+        if load + volume > capacity:
+            trips.append([])
+            load = 0
+        trips[-1].append(t)
+        load += volume
+    return trips
+
+
+def trips_length(
+    trips: list[list[int]], picks: NDArray[np.int64], drop: int, dists: NDArray[np.uint16]
+) -> int:
+    """tripsを順に回る距離 (最初と最後の取り出し口の間で、往復の合間に降ろし先へ寄る分を含む)"""
+    length = sum(route_length(trip, picks, dists) for trip in trips)
+    for prev_trip, next_trip in zip(trips, trips[1:]):
+        length += int(dists[picks[prev_trip[-1]], drop]) + int(dists[drop, picks[next_trip[0]]])
+    return length
@@ -0,0 +1,381 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from typing import Any, Callable, Iterable, Iterator
+
+import numpy as np
+from numpy.typing import NDArray
+
+from behavior_opt.sh_core import Position
+from behavior_opt.sh_core.distance import NIL, UNREACHABLE, grid_distances, neighbor_table
+
+
+class GridGraph:
+    """通行可能マスクとCSR隣接配列で表した4近傍グリッドグラフ
+
+    ノードはPosition(row, col)で扱い、内部ではrow * width + colの通し番号を使う。
+    隣接表と距離の計算はsh_core.distanceのものを使う。
+    """
+
+    def __init__(self, passable: NDArray[np.bool_]) -> None:
+        self.passable: NDArray[np.bool_] = passable
+        self.shape: tuple[int, int] = passable.shape  # type: ignore
+        self.height, self.width = self.shape
+        # (n_cells, 4)の隣接表 (sh_core.distance.neighbor_table)
+        self.neighbor_ids = neighbor_table(passable)
+        self.indptr, self.indices = self._build_adjacency(self.neighbor_ids)
+        # 探索で展開したノード数の累計
+        self.n_expanded = 0
+        self._positions = [
+            Position(row, col) for row in range(self.height) for col in range(self.width)
+        ]
+
+    @classmethod
+    def from_map(cls, map_: NDArray[Any]) -> GridGraph:
+        """棚(1)以外を通行可能とする"""
+        return cls(np.asarray(map_) != 1)
+
+    @staticmethod
+    def _build_adjacency(table: NDArray[np.int32]) -> tuple[NDArray[np.int32], NDArray[np.int32]]:
+        # 隣接表から無効な隣接を除いてCSRに詰める
+        valid = table != NIL
+        indptr = np.zeros(len(table) + 1, dtype=np.int32)
+        np.cumsum(valid.sum(axis=1), out=indptr[1:])
+        return indptr, table[valid]
+
+    def __contains__(self, node: Position) -> bool:
+        return (
+            0 <= node[0] < self.height
+            and 0 <= node[1] < self.width
+            and bool(self.passable[node[0], node[1]])
+        )
+
+    def __len__(self) -> int:
+        return int(self.passable.sum())
+
+    def to_id(self, node: Position) -> int:
+        return node[0] * self.width + node[1]
+
+    def to_position(self, node_id: int) -> Position:
+        return self._positions[node_id]
+
+    @property
+    def nodes(self) -> list[Position]:
+        return [self._positions[i] for i in np.flatnonzero(self.passable).tolist()]
+
+    def neighbors(self, node: Position) -> list[Position]:
+        node_id = node[0] * self.width + node[1]
+        ids = self.indices[self.indptr[node_id] : self.indptr[node_id + 1]]
+        return [self._positions[i] for i in ids.tolist()]
+
+    def degree(self) -> NDArray[np.int32]:
+        """全セルの次数をグリッド形状で返す (通行不可セルは0)"""
+        return np.diff(self.indptr).reshape(self.shape)
+
+    def bfs(self, source: Position, target: Position | None = None) -> NDArray[np.int32]:
+        """sourceからの距離をグリッド形状で返す
+
+        targetを指定した場合はtargetに到達した時点で探索を打ち切る。
+        到達できないセルはUNREACHABLE。
+        """
+        dist = grid_distances(self.passable, source, self.neighbor_ids, target)
+        # 展開したのはtargetより近いノード (targetがなければ到達できた全ノード)
+        reached = UNREACHABLE if target is None else dist[target[0], target[1]]
+        self.n_expanded += int(np.count_nonzero(dist < reached))
+        return dist
+
+    def shortest_path(self, source: Position, target: Position) -> list[Position]:
+        """sourceからtargetまでの最短経路 (両端を含む)"""
+        if source == target:
+            return [self.to_position(self.to_id(source))]
+        dist = self.bfs(target, source).ravel()
+        node_id = self.to_id(source)
+        if dist[node_id] == UNREACHABLE:
+            raise ValueError(f"no path between {source} and {target}")
+        path = [self._positions[node_id]]
+        while dist[node_id] != 0:
+            ids = self.indices[self.indptr[node_id] : self.indptr[node_id + 1]]
+            node_id = int(ids[np.argmax(dist[ids] == dist[node_id] - 1)])
+            path.append(self._positions[node_id])
+        return path
+
+    def shortest_path_length(self, source: Position, target: Position) -> int:
+        dist = int(self.bfs(source, target)[target])
+        if dist == UNREACHABLE:
+            raise ValueError(f"no path between {source} and {target}")
+        return dist
+
+    def search(
+        self,
+        source: Position,
+        is_goal: Callable[[Position], bool],
+        obstacles: Iterable[Position] = (),
+        sort_key: Callable[[Position], Any] | None = None,
+    ) -> list[Position] | None:
+        """obstaclesを避けてsourceから幅優先探索し、最初に見つかったゴールまでの経路を返す
+
+        グラフはコピーせず、ゴールが見つかった時点で探索を打ち切る。
+        sort_keyを指定した場合は各ノードの展開順をsort_keyで並べ替える。
+        見つからなければNone。
+        """
+        closed = bytearray(self.height * self.width)
+        for obstacle in obstacles:
+            if obstacle in self:
+                closed[self.to_id(obstacle)] = 1
+        parents: dict[int, int] = {}
+        open_: deque[tuple[int, int]] = deque([(self.to_id(source), NIL)])
+        while open_:
+            node_id, parent_id = open_.popleft()
+            if closed[node_id]:
+                continue
+            closed[node_id] = 1
+            self.n_expanded += 1
+            parents[node_id] = parent_id
+            node = self._positions[node_id]
+            if is_goal(node):
+                path = [node]
+                while parents[node_id] != NIL:
+                    node_id = parents[node_id]
+                    path.append(self._positions[node_id])
+                path.reverse()
+                return path
+            children = [
+                i
+                for i in self.indices[self.indptr[node_id] : self.indptr[node_id + 1]].tolist()
+                if not closed[i]
+            ]
+            if sort_key is not None:
+                children.sort(key=lambda i: sort_key(self._positions[i]))
+            open_.extend((child, node_id) for child in children)
+        return None
+
+
+class PathOracle:
+    """GridGraph上の最短経路を、到着点ごとのBFS木から引く
+
+    到着点を根とするBFS木 (各ノードから根へ1歩近づく次のノード) と距離をLRUで保持し、
+    同じ到着点へのすべての経路を木をたどるだけで復元する。
+    復元した経路も(出発点, 到着点)ごとにLRUで保持する。
+    経路はGridGraph.shortest_pathと同じく、各ノードで隣接順に最初の近づくノードを選ぶ。
+    """
+
+    def __init__(self, graph: GridGraph, max_trees: int = 256, max_paths: int = 4096) -> None:
+        self.graph = graph
+        self.max_trees = max_trees
+        self.max_paths = max_paths
+        self._trees: OrderedDict[
+            Position, tuple[NDArray[np.int32], NDArray[np.int32]]
+        ] = OrderedDict()
+        self._paths: OrderedDict[tuple[Position, Position], list[Position]] = OrderedDict()
+        self.n_bfs = 0
+        self.n_hits = 0
+        self._neighbors = graph.neighbor_ids
+
+    def _field(self, target: Position) -> tuple[NDArray[np.int32], NDArray[np.int32]]:
+        field = self._trees.get(target)
+        if field is not None:
+            self._trees.move_to_end(target)
+            return field
+        self.n_bfs += 1
+        dist = self.graph.bfs(target).ravel()
+        nbr_dist = np.where(self._neighbors >= 0, dist[self._neighbors], UNREACHABLE)
+        closer = (nbr_dist == (dist - 1).reshape(-1, 1)) & (dist != UNREACHABLE).reshape(-1, 1)
+        tree = np.where(
+            closer.any(axis=1), self._neighbors[np.arange(len(dist)), closer.argmax(axis=1)], NIL
+        ).astype(np.int32)
+        self._trees[target] = (dist, tree)
+        if len(self._trees) > self.max_trees:
+            self._trees.popitem(last=False)
+        return dist, tree
+
+    def dist_field(self, target: Position) -> NDArray[np.int32]:
+        """各ノードからtargetまでの距離 (ノード番号順、到達できないノードはUNREACHABLE)"""
+        return self._field(target)[0]
+
+    def tree(self, target: Position) -> NDArray[np.int32]:
+        """targetへ向かう各ノードの次のノード番号 (targetと到達できないノードはNIL)"""
+        return self._field(target)[1]
+
+    def shortest_path(self, source: Position, target: Position) -> list[Position]:
+        """sourceからtargetまでの最短経路 (両端を含む)"""
+        key = (source, target)
+        path = self._paths.get(key)
+        if path is not None:
+            self.n_hits += 1
+            self._paths.move_to_end(key)
+            return list(path)
+        graph = self.graph
+        node_id = graph.to_id(source)
+        target_id = graph.to_id(target)
+        path = [graph.to_position(node_id)]
+        if node_id != target_id:
+            tree = self.tree(target)
+            if tree[node_id] == NIL:
+                raise ValueError(f"no path between {source} and {target}")
+            while node_id != target_id:
+                node_id = int(tree[node_id])
+                path.append(graph.to_position(node_id))
+        self._paths[key] = path
+        if len(self._paths) > self.max_paths:
+            self._paths.popitem(last=False)
+        return list(path)
+
+
+class RingIndex:
+    """グリッド上の点集合を、ある点からのマンハッタン距離が近い順に列挙する
+
+    距離dの菱形の輪を内側から順に調べるので、近くの点を見つけるのに全点を並べ替える必要がない。
+    同じ距離の点は行優先の順で返す。
+    """
+
+    def __init__(self, mask: NDArray[np.bool_]) -> None:
+        self.mask: NDArray[np.bool_] = mask
+        self.height, self.width = mask.shape
+
+    def __contains__(self, pos: Position) -> bool:
+        return (
+            0 <= pos[0] < self.height
+            and 0 <= pos[1] < self.width
+            and bool(self.mask[pos[0], pos[1]])
+        )
+
+    def __len__(self) -> int:
+        return int(self.mask.sum())
+
+    def _ring(self, origin: Position, d: int) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+        rows = np.arange(origin[0] - d, origin[0] + d + 1)
+        dc = d - np.abs(rows - origin[0])
+        # 各行で左、右の順 (dc == 0の行は1点)
+        rows = np.repeat(rows, 2)
+        cols = np.stack([origin[1] - dc, origin[1] + dc], axis=1).ravel()
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1::2] = dc > 0
+        rows, cols = rows[keep], cols[keep]
+        inside = (0 <= rows) & (rows < self.height) & (0 <= cols) & (cols < self.width)
+        rows, cols = rows[inside], cols[inside]
+        hit = self.mask[rows, cols]
+        return rows[hit], cols[hit]
+
+    def nearest(self, origin: Position) -> Iterator[Position]:
+        """originに近い順に点を返す"""
+        max_dist = (
+            max(origin[0], self.height - 1 - origin[0])
+            + max(origin[1], self.width - 1 - origin[1])
+        )
+        for d in range(max_dist + 1):
+            rows, cols = self._ring(origin, d)
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                yield Position(row, col)
+
+
+class BucketIndex:
+    """グリッド上の点 (重複可) を、マンハッタン距離の近い順に引けるように持つ
+
+    点には入力順に0, 1, ...の番号を振り、同じマスの点は番号順にまとめる。
+    マスはbucket_size四方のバケツに分け、問い合わせ点のバケツから外側へ1周ずつ調べて、
+    それより外に近い点がありえなくなった時点で打ち切る。
+    点は削除でき、削除した点は以後返さない。
+    """
+
+    # _ring_offsetsの結果 (全インスタンスで共有)
+    _offsets: list[list[tuple[int, int]]] = []
+
+    def __init__(self, points: Iterable[Position], bucket_size: int = 4) -> None:
+        assert bucket_size > 0, f"invalid bucket_size: {bucket_size}"
+        self.bucket_size = bucket_size
+        self._points: list[Position] = [Position(*point) for point in points]
+        # マス -> そのマスにある点の番号 (昇順)
+        self._cells: dict[Position, list[int]] = {}
+        for point_id, point in enumerate(self._points):
+            self._cells.setdefault(point, []).append(point_id)
+        # バケツ -> 点のあるマス
+        self._buckets: dict[tuple[int, int], set[Position]] = {}
+        for cell in self._cells:
+            self._buckets.setdefault(self._bucket(cell), set()).add(cell)
+        self._removed = bytearray(len(self._points))
+        self._size = len(self._points)
+        if self._buckets:
+            rows, cols = zip(*self._buckets)
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, point_id: int) -> bool:
+        return 0 <= point_id < len(self._points) and not self._removed[point_id]
+
+    def _bucket(self, pos: Position) -> tuple[int, int]:
+        return pos[0] // self.bucket_size, pos[1] // self.bucket_size
+
+    def remove(self, point_id: int) -> None:
+        assert point_id in self, f"point {point_id} is not in the index"
+        self._removed[point_id] = 1
+        self._size -= 1
+        cell = self._points[point_id]
+        ids = self._cells[cell]
+        del ids[bisect_left(ids, point_id)]
+        if not ids:
+            del self._cells[cell]
+            bucket = self._bucket(cell)
+            self._buckets[bucket].discard(cell)
+            if not self._buckets[bucket]:
+                del self._buckets[bucket]
+
+    def nearest(
+        self, origin: Position, dist_func: Callable[[Position], int] | None = None
+    ) -> tuple[int, int] | None:
+        """originに最も近い点の(番号, 距離) (同じ距離なら番号の小さい点、空ならNone)
+
+        dist_funcを指定した場合は、点のあるマスを受け取ってoriginからの距離を返すdist_funcで比べる。
+        dist_funcはマンハッタン距離以上の値を返すこと (歩行距離など)。
+        """
+        if self._size == 0:
+            return None
+        row_min, row_max, col_min, col_max = self._bounds
+        origin_row, origin_col = origin[0], origin[1]
+        bucket_row, bucket_col = self._bucket(origin)
+        max_ring = max(
+            bucket_row - row_min, row_max - bucket_row, bucket_col - col_min, col_max - bucket_col
+        )
+        buckets, cells = self._buckets, self._cells
+        bucket_size = self.bucket_size
+        best_dist, best_id = UNREACHABLE, NIL
+        for ring in range(max_ring + 1):
+            for d_row, d_col in self._ring_offsets(ring):
+                bucket = buckets.get((bucket_row + d_row, bucket_col + d_col))
+                if bucket is None:
+                    continue
+                for cell in bucket:
+                    if dist_func is None:
+                        dist = abs(cell[0] - origin_row) + abs(cell[1] - origin_col)
+                    else:
+                        dist = dist_func(cell)
+                    if dist < best_dist or (dist == best_dist and cells[cell][0] < best_id):
+                        best_dist, best_id = dist, cells[cell][0]
+            # 次の周のバケツの点は、ここまで調べた範囲 (top, left から span 四方) の外にあり、
+            # マンハッタン距離でもそれより近い点が見つかっていれば打ち切る
+            # (同じ距離なら番号の小さい点がありうる)
+            top = (bucket_row - ring) * bucket_size
+            left = (bucket_col - ring) * bucket_size
+            span = (2 * ring + 1) * bucket_size
+            if best_dist < min(
+                origin_row - top + 1,
+                top + span - origin_row,
+                origin_col - left + 1,
+                left + span - origin_col,
+            ):
+                break
+        return best_id, best_dist
+
+    @classmethod
+    def _ring_offsets(cls, ring: int) -> list[tuple[int, int]]:
+        """チェビシェフ距離がringのバケツへの相対位置"""
+        while len(cls._offsets) <= ring:
+            r = len(cls._offsets)
+            offsets = [(-r, c) for c in range(-r, r + 1)]
+            if r > 0:
+                offsets += [(r, c) for c in range(-r, r + 1)]
+                offsets += [(d, side) for d in range(-r + 1, r) for side in (-r, r)]
+            cls._offsets.append(offsets)
+        return cls._offsets[ring]
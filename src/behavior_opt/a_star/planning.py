@@ -3,23 +3,31 @@ from copy import deepcopy
 from pathlib import Path
 
 import numpy as np
-
-from behavior_opt.a_star.push_and_swap import Plan_t, PushAndSwap
-from behavior_opt.a_star.task_assignment import NearestTaskAssignment
-from behavior_opt.sh_core import World, Objective
+from numpy.typing import NDArray
+
+from behavior_opt.a_star.push_and_swap import PushAndSwap
+from behavior_opt.a_star.sipp import SIPP
+from behavior_opt.a_star.task_assignment import (
+    AuctionTaskAssignment,
+    NearestTaskAssignment,
+    SavingsTaskAssignment,
+)
+from behavior_opt.sh_core import World, Objective, Position
 from behavior_opt.utils.file_io import (
     read_agent_config,
+    read_compiled_map,
     read_item_config,
     read_map_config,
     read_picking_list,
 )
+from behavior_opt.utils.validation import check_trajectory, find_conflicts, summarize
 
 
 def format_result(
-    result: list[Plan_t], current_agents, agents, first_positions
-) -> list[list[str]]:
-    result = np.array(result)
-    result = np.array(list(map(lambda x: x.ravel(), result)))
+    result: NDArray[np.int32], current_agents, agents, first_positions
+) -> NDArray[np.int32]:
+    # (T, n_agents, 2) -> (T, n_agents * 2)
+    result = result.reshape(len(result), -1)
     solution = np.repeat([np.array(first_positions).ravel()], len(result), axis=0)
     current_agents_names = list(map(lambda x: x.name, current_agents))
     j = 0
@@ -76,9 +84,10 @@ def write_output_csv(
 
 def check_invaild_move(result, first_positions):
     assert (result[0] == first_positions).all(), "first position is not same"
-    if len(result) > 1:
-        result_diff = np.diff(result, axis=0)
-        assert (np.abs(result_diff) <= 1).all(), "Invalid move"
+    # 作業を終えたエージェントは他のエージェントと重なりうるので、移動幅だけを確認する
+    conflicts = find_conflicts(result.reshape(len(result), -1, 2))
+    jumps = [conflict for conflict in conflicts if conflict.kind == "jump"]
+    assert len(jumps) == 0, f"Invalid move: {jumps[:5]}"
 
 
 def planning(
@@ -88,6 +97,10 @@ def planning(
     item_config_path: Path,
     picking_list_path: Path,
     output_dir: Path,
+    time_limit: float | None = None,
+    portfolio: bool = False,
+    solver: str = "push_and_swap",
+    assignment: str = "nearest",
 ):
     map_config = read_map_config(map_config_path, config_path)
     picking_list = read_picking_list(picking_list_path)
@@ -98,16 +111,33 @@ def planning(
         item_configs=item_configs,
         agent_configs=agent_configs,
         picking_list=picking_list,
+        compiled_map=read_compiled_map(map_config_path),
     )
     current_agents = world.agents
     copy_agents = deepcopy(current_agents)
     plain_map = world.plain_map
-    task_assignment = NearestTaskAssignment(world)
+    if assignment == "nearest":
+        task_assignment = NearestTaskAssignment(world)
+    elif assignment == "savings":
+        task_assignment = SavingsTaskAssignment(world)
+    elif assignment == "auction":
+        task_assignment = AuctionTaskAssignment(world)
+    else:
+        raise ValueError(f"unknown assignment: {assignment}")
     task_assignment.assign()
     copy_task_assignment = deepcopy(task_assignment)
     first_positions = np.array([agent.pos for agent in world.agents]).ravel()
     output = np.array(first_positions).ravel()
     action_output = [[] for _ in range(len(world.agents))]
+    # グラフや距離場はラウンドをまたいで使い回す
+    if solver == "push_and_swap":
+        path_planner = PushAndSwap(current_agents, plain_map)
+    elif solver == "sipp":
+        if portfolio:
+            raise ValueError("portfolio mode is only available for push_and_swap")
+        path_planner = SIPP(current_agents, plain_map)
+    else:
+        raise ValueError(f"unknown solver: {solver}")
     while True:
         print(f"####{sum(map(len, task_assignment.assigned_tasks))}####")
         for agent_id, agent in enumerate(current_agents):
@@ -119,16 +149,16 @@ def planning(
         if len(current_agents) == 0:
             break
         task_assignment.set_target()
-        push_and_swap = PushAndSwap(current_agents, plain_map)
-        result, finished_agents = push_and_swap.run()
+        if portfolio:
+            result, finished_agents = path_planner.run_portfolio(time_limit=time_limit)
+        else:
+            result, finished_agents = path_planner.run(time_limit=time_limit)
         assert result is not None, "result is None"
-        last_positions: Plan_t = result[-1]
+        # 計画中のエージェント同士の衝突、棚への侵入、飛び移りがないことを確認する
+        check_trajectory(result, plain_map)
+        last_positions = [Position(*pos) for pos in result[-1].tolist()]
         for agent_id, agent in enumerate(current_agents):
             agent.pos = last_positions[agent_id]
-            other_agent_pos = [
-                pos for i, pos in enumerate(last_positions) if agent_id != i
-            ]
-            assert agent.pos not in other_agent_pos, f"{agent.pos} {other_agent_pos}"
         result = format_result(result, current_agents, copy_agents, first_positions)
         check_invaild_move(result, first_positions)
         first_positions = result[-1].copy()
@@ -137,9 +167,16 @@ def planning(
             if agent_id in finished_agents:
                 idx = copy_agents.index(agent.name)
                 action_output[idx].append(len(output) - 1)
+        if path_planner.timed_out and len(finished_agents) == 0:
+            # 時間内に誰もtargetに着けなかった場合は、ここまでの計画で打ち切る
+            print(f"timeout: no agent reached its target within {time_limit}s")
+            break
 
     print(output)
     print("makespan:", len(output))
+    # 作業を終えて止まっているエージェントとの衝突も含めた全体の違反件数
+    conflicts = find_conflicts(output.reshape(len(output), -1, 2), plain_map)
+    print("conflicts:", summarize(conflicts))
     write_output_csv(
         output_dir, output, action_output, copy_task_assignment, copy_agents
     )
@@ -155,6 +192,10 @@ if __name__ == "__main__":
     parser.add_argument("-c", "--config-path", required=True, type=Path)
     parser.add_argument("-p", "--picking-list-path", required=True, type=Path)
     parser.add_argument("-o", "--output-dir", required=True, type=Path)
+    parser.add_argument("-t", "--time-limit", required=False, type=float)
+    parser.add_argument("--portfolio", action="store_true")
+    parser.add_argument("--solver", default="push_and_swap", choices=["push_and_swap", "sipp"])
+    parser.add_argument("--assignment", default="nearest", choices=["nearest", "savings", "auction"])
     args = parser.parse_args()
     map_config_path: Path = args.map_config_path
     config_path = args.config_path
@@ -162,6 +203,10 @@ if __name__ == "__main__":
     item_config_path = args.item_config_path
     picking_list_path: Path = args.picking_list_path
     output_dir: Path = args.output_dir
+    time_limit: float | None = args.time_limit
+    portfolio: bool = args.portfolio
+    solver: str = args.solver
+    assignment: str = args.assignment
     planning(
         config_path=config_path,
         map_config_path=map_config_path,
@@ -169,4 +214,8 @@ if __name__ == "__main__":
         item_config_path=item_config_path,
         picking_list_path=picking_list_path,
         output_dir=output_dir,
+        time_limit=time_limit,
+        portfolio=portfolio,
+        solver=solver,
+        assignment=assignment,
     )
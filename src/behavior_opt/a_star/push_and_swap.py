@@ -1,17 +1,25 @@
 from __future__ import annotations
 
-from collections import defaultdict, deque
-from copy import deepcopy
+import contextlib
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any, Iterator, Literal, TypeAlias, overload
 
-import networkx as nx
 import numpy as np
-from networkx.classes import Graph
 from numpy.typing import NDArray
 
+from behavior_opt.a_star.grid_graph import GridGraph, RingIndex
 from behavior_opt.sh_core import Agent, Position
 
 NIL = -1
+# 保持する距離場の数 (1つあたりマップのセル数 * 4 byte)
+DIST_FIELD_CACHE_SIZE = 256
+
+
+class _BudgetExceeded(Exception):
+    pass
 
 
 class Path:
@@ -38,21 +46,58 @@ class Path:
         return self._path.pop(i)
 
 
-Plan_t: TypeAlias = list[Position]
+# ある時刻の全エージェントの位置 (n_agents, 2)
+Plan_t: TypeAlias = NDArray[np.int32]
 
 
 class Plan:
-    def __init__(self, solution: list[Plan_t]) -> None:
-        self.solution: list[Plan_t] = solution
+    """全エージェントの位置の時系列を(T, n_agents, 2)のint32配列で保持する
+
+    配列は容量を倍々に確保し、appendは1行の書き込みだけで済ませる。
+    """
+
+    MIN_CAPACITY = 16
+
+    def __init__(self, solution: NDArray[np.int32] | list[list[Position]]) -> None:
+        self._buffer: NDArray[np.int32] | None = None
+        self._length = 0
+        if len(solution) > 0:
+            solution = np.asarray(solution, dtype=np.int32)
+            self._reserve(len(solution), solution.shape[1])
+            self._buffer[: len(solution)] = solution  # type: ignore
+            self._length = len(solution)
+
+    @property
+    def solution(self) -> NDArray[np.int32]:
+        """(T, n_agents, 2)の配列 (バッファのビュー)"""
+        if self._buffer is None:
+            return np.empty((0, 0, 2), dtype=np.int32)
+        return self._buffer[: self._length]
 
     def __iter__(self) -> Iterator[Plan_t]:
         return iter(self.solution)
 
     def __len__(self) -> int:
-        return len(self.solution)
+        return self._length
 
     def __add__(self, other: Plan) -> Plan:
-        return Plan(self.solution + other.solution)
+        plan = Plan(self.solution)
+        plan.extend(other)
+        return plan
+
+    def __iadd__(self, other: Plan) -> Plan:
+        self.extend(other)
+        return self
+
+    def _reserve(self, length: int, n_agents: int) -> None:
+        if self._buffer is None:
+            capacity = max(length, self.MIN_CAPACITY)
+            self._buffer = np.empty((capacity, n_agents, 2), dtype=np.int32)
+        elif length > len(self._buffer):
+            capacity = max(length, 2 * len(self._buffer))
+            buffer = np.empty((capacity, n_agents, 2), dtype=np.int32)
+            buffer[: self._length] = self._buffer[: self._length]
+            self._buffer = buffer
 
     @overload
     def last(self) -> Plan_t:
@@ -63,22 +108,83 @@ class Plan:
         ...
 
     def last(self, agent_id: int | None = None) -> Position | Plan_t:
+        """最後の時刻の配置 (ビュー)、またはagent_idの最後の位置を返す"""
+        assert self._buffer is not None, "plan is empty"
         if agent_id is None:
-            return self.solution[self.get_makespan()].copy()
-        else:
-            return self.solution[self.get_makespan()][agent_id]
+            return self._buffer[self._length - 1]
+        return Position(*self._buffer[self._length - 1, agent_id].tolist())
 
     def empty(self) -> bool:
-        return len(self.solution) == 0
-
-    def append(self, path: Plan_t) -> None:
-        self.solution.append(path)
+        return self._length == 0
+
+    def append(self, path: Plan_t | list[Position]) -> None:
+        path = np.asarray(path, dtype=np.int32)
+        self._reserve(self._length + 1, len(path))
+        self._buffer[self._length] = path  # type: ignore
+        self._length += 1
+
+    def move(self, agent_id: int, pos: Position) -> None:
+        """最後の配置からagent_idだけをposに動かした配置を追加する"""
+        assert self._buffer is not None, "plan is empty"
+        self._reserve(self._length + 1, self._buffer.shape[1])
+        self._buffer[self._length] = self._buffer[self._length - 1]
+        self._buffer[self._length, agent_id] = pos
+        self._length += 1
+
+    def extend(self, other: Plan) -> None:
+        if other.empty():
+            return
+        n_agents = other.solution.shape[1]
+        self._reserve(self._length + len(other), n_agents)
+        self._buffer[self._length : self._length + len(other)] = other.solution  # type: ignore
+        self._length += len(other)
 
     def get_makespan(self) -> int:
-        return len(self.solution) - 1
+        return self._length - 1
+
+    def checkpoint(self) -> int:
+        return self._length
+
+    def rollback(self, checkpoint: int) -> None:
+        """checkpoint以降に追加した配置を取り消す"""
+        assert checkpoint <= self._length, "invalid checkpoint"
+        self._length = checkpoint
+
+
+class Occupancy:
+    """ノードを占有しているエージェントID (いなければNIL)
+
+    書き込みを履歴に残し、checkpointまで巻き戻せるようにする。
+    """
+
+    def __init__(self) -> None:
+        self._occupied: dict[Position, int] = {}
+        self._log: list[tuple[Position, int]] = []
+
+    def __getitem__(self, node: Position) -> int:
+        return self._occupied.get(node, NIL)
+
+    def __setitem__(self, node: Position, agent_id: int) -> None:
+        self._log.append((node, self[node]))
+        self._occupied[node] = agent_id
+
+    def checkpoint(self) -> int:
+        return len(self._log)
+
+    def rollback(self, checkpoint: int) -> None:
+        """checkpoint以降の書き込みを新しい順に取り消す"""
+        while len(self._log) > checkpoint:
+            node, agent_id = self._log.pop()
+            self._occupied[node] = agent_id
 
 
 class PushAndSwap:
+    """Push and Swapによる経路計画
+
+    グラフ、swap用の頂点、targetごとの距離場はインスタンスに保持され、
+    同じマップで繰り返しrun()を呼ぶ場合は新しいtargetの分だけ計算する。
+    """
+
     def __init__(
         self,
         agents: list[Agent],
@@ -90,27 +196,46 @@ class PushAndSwap:
         self._disable_dist_init: bool = False
         self.agents = agents
         self.n_agents = len(agents)
-        self.graph = self.create_graph(world_map)
+        self.graph = GridGraph.from_map(world_map)
         self.enable_dist_init = enable_dist_init
+        # target -> distance field (LRU)
+        self._dist_fields: OrderedDict[Position, NDArray[np.int32]] = OrderedDict()
+        self.find_nodes_with_many_neighbors()
 
-    def run(self):
+    def run(
+        self,
+        time_limit: float | None = None,
+        max_expansions: int | None = None,
+        agent_order: list[int] | None = None,
+    ):
+        """全エージェントをtargetまで動かす計画を立てる
+
+        time_limit[秒]または探索ノード数max_expansionsを超えた場合は、
+        それまでに確定した移動だけの計画を返し、self.timed_outをTrueにする。
+        agent_orderを指定した場合はその順に計画する。
+        """
         assert None not in [agent.target for agent in self.agents], "invalid target"
-        self._nodes_with_many_neighbors: list[Position] = []
+        # agentsは呼び出し側で減ることがある
+        self.n_agents = len(self.agents)
+        self.timed_out = False
+        self._deadline = None if time_limit is None else time.perf_counter() + time_limit
         self.plan = Plan([[agent.pos for agent in self.agents]])
         # occupancy
-        self.occupied_now: defaultdict[Position, int] = defaultdict(lambda: NIL)
-        nx.set_node_attributes(self.graph, name="occupied", values=NIL)  # type: ignore
-        for agent_id, sol_per_agent in enumerate(self.plan.last()):
-            self.occupied_now[sol_per_agent] = agent_id
-        # pre-processing
-        self.find_nodes_with_many_neighbors()
+        self.occupied_now = Occupancy()
+        for agent_id in range(self.n_agents):
+            self.occupied_now[self.plan.last(agent_id)] = agent_id
         # nodes with agents at goals
         nodes_U: list[Position] = []
         agent_ids = list(range(self.n_agents))
         # prioritization
-        if self.enable_dist_init:
+        if agent_order is not None:
+            assert sorted(agent_order) == agent_ids, "invalid agent order"
+            agent_ids = list(agent_order)
+        elif self.enable_dist_init:
             agent_ids.sort(
-                key=lambda agent_id: nx.shortest_path_length(self.graph, self.agents[agent_id].pos, self.agents[agent_id].target)  # type: ignore
+                key=lambda agent_id: self.get_dist(
+                    self.agents[agent_id].pos, self.agents[agent_id].target  # type: ignore
+                )
             )
 
         # if target is same, change target
@@ -118,28 +243,39 @@ class PushAndSwap:
         other_agents_target: list[Position] = []
         for agent_id in agent_ids:
             if self.agents[agent_id].target != self.agents[agent_id].pos:
-                while self.agents[agent_id].target in other_agents_target:
+                # 自分の位置まで戻ったら、それ以上は手前にできない
+                while (
+                    self.agents[agent_id].target in other_agents_target
+                    and self.agents[agent_id].target != self.agents[agent_id].pos
+                ):
                     self.agents[agent_id].target = Position(
-                        *nx.shortest_path(  # type: ignore
-                            self.graph,
+                        *self.graph.shortest_path(
                             self.agents[agent_id].pos,
-                            self.agents[agent_id].target,
+                            self.agents[agent_id].target,  # type: ignore
                         )[-2]
                     )
             other_agents_target.append(self.agents[agent_id].target)
         # main loop
+        self._max_expansions = (
+            None if max_expansions is None else self.graph.n_expanded + max_expansions
+        )
         for j in range(self.n_agents):
             agent_id = agent_ids[j]
             print(
                 f"agent-{agent_id} starts planning, makespan: {len(self.plan)},progress: {j+1}/{self.n_agents}"
             )
-            while self.plan.last(agent_id) != self.agents[agent_id].target:
-                if not self.push(agent_id, nodes_U):
-                    print(f"swap required, timestep: {len(self.plan)}")
-                    if not self.swap(agent_id, nodes_U):
-                        return
+            try:
+                while self.plan.last(agent_id) != self.agents[agent_id].target:
+                    if not self.push(agent_id, nodes_U):
+                        print(f"swap required, timestep: {len(self.plan)}")
+                        if not self.swap(agent_id, nodes_U):
+                            return
+            except _BudgetExceeded as e:
+                # 確定済みの移動はそのまま返す (試行中のswapはswap内で取り消す)
+                self.timed_out = True
+                print(f"{e} exceeded, timestep: {len(self.plan)}")
+                break
             nodes_U.append(self.plan.last(agent_id))
-            # !ここに時間制限を入れる
         for agent_id, target in enumerate(tmp_targets):
             self.agents[agent_id].target = target
         if self._fig_compress:
@@ -151,7 +287,7 @@ class PushAndSwap:
 
         finished_agents: list[int] = []
         for agent_id, is_finished in enumerate(
-            [Position(*p) == t for p, t in zip(self.plan.last(), targets)]
+            [self.plan.last(i) == t for i, t in enumerate(targets)]
         ):
             if is_finished:
                 print(f"agent-{agent_id} finished")
@@ -160,6 +296,101 @@ class PushAndSwap:
 
         return self.plan.solution, finished_agents
 
+    def get_agent_orders(
+        self, n_random: int = 2, seed: int = 0
+    ) -> dict[str, list[int]]:
+        """ポートフォリオで試すエージェントの計画順"""
+        n_agents = len(self.agents)
+        dists = [self.get_dist(a.pos, a.target) for a in self.agents]  # type: ignore
+        target_degree = self.graph.degree()
+        orders = {
+            "dist_asc": sorted(range(n_agents), key=lambda i: dists[i]),
+            "dist_desc": sorted(range(n_agents), key=lambda i: -dists[i]),
+            # 行き止まりなど逃げ場の少ないtargetを持つエージェントから
+            "most_constrained": sorted(
+                range(n_agents),
+                key=lambda i: (target_degree[self.agents[i].target], -dists[i]),
+            ),
+        }
+        rng = np.random.default_rng(seed)
+        for k in range(n_random):
+            orders[f"random_{seed + k}"] = rng.permutation(n_agents).tolist()
+        return orders
+
+    def run_portfolio(
+        self,
+        time_limit: float | None = None,
+        max_workers: int | None = None,
+        n_random: int = 2,
+        seed: int = 0,
+    ):
+        """複数の計画順でrun()を別プロセスで並列に解き、最も進んだ計画を採用する
+
+        run()の計画は最初に誰かが到着した時点で切られるので、makespanだけで比べると
+        1台を早く着かせる計画順が選ばれてしまう。そこで時間切れでないもの、到着したエージェントが
+        多いもの、圧縮後のmakespanが短いものの順に優先する。
+        time_limitは全計画順で共有する締め切り。各計画順の所要時間はself.portfolio_timingsに残す
+        (例外で失敗した計画順はNone)。失敗した計画順は除いて選び、全て失敗したらRuntimeError。
+        """
+        orders = self.get_agent_orders(n_random, seed)
+        # プロセス間で比較するので壁時計で締め切りを渡す
+        deadline = None if time_limit is None else time.time() + time_limit
+        max_workers = min(len(orders), max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_portfolio_worker,
+            initargs=(self,),
+        ) as executor:
+            futures = {
+                name: executor.submit(_run_portfolio_worker, name, order, deadline)
+                for name, order in orders.items()
+            }
+            results = []
+            errors: dict[str, BaseException] = {}
+            for name, future in futures.items():
+                # 1つの計画順の失敗で他の計画順の結果を捨てない
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    errors[name] = e
+
+        self.portfolio_timings: dict[str, float | None] = {}
+        for name, e in errors.items():
+            self.portfolio_timings[name] = None
+            print(f"order {name}: failed, {e!r}")
+        best = None
+        for name, solution, finished_agents, timed_out, elapsed in results:
+            self.portfolio_timings[name] = elapsed
+            if solution is None:
+                print(f"order {name}: failed, {elapsed:.3f}s")
+                continue
+            print(
+                f"order {name}: makespan {len(solution) - 1}, "
+                f"finished {len(finished_agents)}, timed out {timed_out}, {elapsed:.3f}s"
+            )
+            # ラウンド全体で比べる (到着した台数が多いほど先に進んでいる)
+            key = (timed_out, -len(finished_agents), len(solution))
+            if best is None or key < best[0]:
+                best = (key, name, solution, finished_agents, timed_out)
+        if best is None:
+            raise RuntimeError(f"all orderings failed: {sorted(orders)}")
+        _, name, solution, finished_agents, self.timed_out = best
+        print(f"order {name} is selected")
+        self.n_agents = len(self.agents)
+        self.plan = Plan(solution)
+        for agent_id in finished_agents:
+            self.agents[agent_id].target = None
+        return self.plan.solution, finished_agents
+
+    def _check_budget(self) -> None:
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            raise _BudgetExceeded("time limit")
+        if (
+            self._max_expansions is not None
+            and self.graph.n_expanded > self._max_expansions
+        ):
+            raise _BudgetExceeded("node expansion limit")
+
     def push(self, agent_id: int, nodes_U: list[Position]) -> bool:
         if self.plan.last(agent_id) == self.agents[agent_id].target:
             return True
@@ -197,53 +428,51 @@ class PushAndSwap:
         if agent2_id == NIL:
             return True
 
-        c_before = self.plan.last()
+        c_before = self.plan.last().copy()
         success = False
-        swap_vertices = self._nodes_with_many_neighbors.copy()
 
-        # sort, make swap operation easy
+        # visit swap vertices nearest first, make swap operation easy
         node_v: Position = p_star.path[0]
-
-        def manhattan_dist(pos: Position):
-            return abs(pos[0] - node_v[0]) + abs(pos[1] - node_v[1])
-
-        swap_vertices.sort(key=lambda v: manhattan_dist(v))
-        swap_vertices.pop(0)
-        while (len(swap_vertices) != 0) and not success:
-            node_v = swap_vertices.pop(0)
-            p: Path = Path(nx.shortest_path(self.graph, self.plan.last(agent1_id), node_v))  # type: ignore
-            tmp_plan: Plan = Plan([])
-            tmp_plan.append(self.plan.last())
-            tmp_occupied_now = self.occupied_now.copy()
-            can_multi_push, tmp_plan, tmp_occupied_now = self.multi_push(
-                tmp_plan,
-                agent1_id,
-                agent2_id,
-                p,
-                tmp_occupied_now,
-            )
-            if (node_v == self.plan.last(agent1_id)) or can_multi_push:
-                is_clear, tmp_plan, tmp_occupied_now = self.clear(
-                    tmp_plan, node_v, agent1_id, agent2_id, tmp_occupied_now
+        swap_vertices = self._nodes_with_many_neighbors.nearest(node_v)
+        next(swap_vertices, None)
+        # try each swap vertex on the plan itself and roll back on failure
+        node_s = self.plan.last(agent1_id)
+        plan_checkpoint = self.plan.checkpoint()
+        occupied_checkpoint = self.occupied_now.checkpoint()
+        for node_v in swap_vertices:
+            p: Path = Path(self.graph.shortest_path(node_s, node_v))
+            self.plan.append(self.plan.last())
+            try:
+                self._check_budget()
+                can_multi_push, self.plan, self.occupied_now = self.multi_push(
+                    self.plan,
+                    agent1_id,
+                    agent2_id,
+                    p,
+                    self.occupied_now,
                 )
-                if is_clear:
-                    success = True
+                if (node_v == node_s) or can_multi_push:
+                    is_clear, self.plan, self.occupied_now = self.clear(
+                        self.plan, node_v, agent1_id, agent2_id, self.occupied_now
+                    )
+                    if is_clear:
+                        success = True
+            finally:
+                if not success:
+                    self.plan.rollback(plan_checkpoint)
+                    self.occupied_now.rollback(occupied_checkpoint)
+            if success:
+                break
         if not success:
             return False
 
-        for i in range(self.n_agents):
-            self.occupied_now[self.plan.last(i)] = NIL
-        self.plan += tmp_plan
-        for i in range(self.n_agents):
-            self.occupied_now[self.plan.last(i)] = i
-
+        tmp_solution = self.plan.solution[plan_checkpoint:].copy()
         self.execute_swap(agent1_id, agent2_id)
-        reversed_tmp_plan = Plan([])
-        makespan = tmp_plan.get_makespan()
-        for t in range(0, makespan + 1)[::-1]:
-            c = tmp_plan.solution[t].copy()
-            c[agent1_id], c[agent2_id] = c[agent2_id], c[agent1_id]
-            reversed_tmp_plan.append(c)
+        reversed_solution = tmp_solution[::-1]
+        reversed_solution[:, [agent1_id, agent2_id]] = reversed_solution[
+            :, [agent2_id, agent1_id]
+        ]
+        reversed_tmp_plan = Plan(reversed_solution)
 
         for i in range(self.n_agents):
             self.occupied_now[self.plan.last(i)] = NIL
@@ -252,19 +481,11 @@ class PushAndSwap:
             self.occupied_now[self.plan.last(i)] = i
 
         c_after = self.plan.last()
-        for i in range(self.n_agents):
-            assert not (
-                (i == agent2_id and c_after[agent2_id] != c_before[agent1_id])
-                or (i == agent1_id and c_after[agent1_id] != c_before[agent2_id])
-                or (i != agent1_id and i != agent2_id and c_before[i] != c_after[i])
-            ), "invalid swap operation"
-            assert (
-                (i != agent2_id or c_after[agent2_id] == c_before[agent1_id])
-                and (i != agent1_id or c_after[agent1_id] == c_before[agent2_id])
-                and (i == agent1_id or i == agent2_id or c_before[i] == c_after[i])
-            ), "invalid swap operation"
+        c_expected = c_before.copy()
+        c_expected[[agent1_id, agent2_id]] = c_before[[agent2_id, agent1_id]]
+        assert (c_after == c_expected).all(), "invalid swap operation"
         print(
-            f"agent-{agent1_id}, agent-{agent2_id} swap locations {c_before[agent1_id]} -> {c_after[agent1_id]}"
+            f"agent-{agent1_id}, agent-{agent2_id} swap locations {tuple(c_before[agent1_id])} -> {tuple(c_after[agent1_id])}"
         )
         if self.agents[agent2_id].target in nodes_U:
             return self.resolve(agent1_id, agent2_id, nodes_U)
@@ -273,8 +494,8 @@ class PushAndSwap:
     def resolve(self, agent1_id: int, agent2_id: int, nodes_U: list[Position]):
         print(f"resolve: {agent1_id}")
         # create shortest path
-        assert self.plan.last(agent1_id) in nx.neighbors(
-            self.graph, self.plan.last(agent2_id)
+        assert self.plan.last(agent1_id) in self.graph.neighbors(
+            self.plan.last(agent2_id)
         ), "invalid resolve operation"
         ideal_loc_s = self.plan.last(agent1_id)
 
@@ -285,6 +506,10 @@ class PushAndSwap:
             # case 1. push
             path = self.get_shortest_path(_agent1_id, ideal_loc_s)
             assert not path.empty(), "never-happen situations"
+            if len(path) < 2:
+                # _agent1_idが自分のtargetにいて、それより先に押し出せない
+                # (既定以外の計画順で起きる。この計画順は失敗として扱う)
+                return False
             if self.occupied_now[path.path[1]] != NIL:
                 obstacles = nodes_U.copy()
                 obstacles.append(self.plan.last(agent2_id))
@@ -316,8 +541,8 @@ class PushAndSwap:
         agent1_id: int,
         agent2_id: int,
         path: Path,
-        occupied_now: defaultdict[Position, int],
-    ) -> tuple[bool, Plan, defaultdict[Position, int]]:
+        occupied_now: Occupancy,
+    ) -> tuple[bool, Plan, Occupancy]:
         p_size = len(path)
         assert p_size > 0, "path is empty"
         # case 1
@@ -362,10 +587,9 @@ class PushAndSwap:
             )
         return True, plan, occupied_now
 
-    def check_consistency(self, plan: Plan, occupied_now: defaultdict[Position, int]):
-        c = plan.last()
+    def check_consistency(self, plan: Plan, occupied_now: Occupancy):
         for agent_id in range(self.n_agents):
-            assert occupied_now[c[agent_id]] == agent_id, "check consistency"
+            assert occupied_now[plan.last(agent_id)] == agent_id, "check consistency"
 
     # clear operation
     def clear(
@@ -374,7 +598,7 @@ class PushAndSwap:
         node_v: Position,
         agent1_id: int,
         agent2_id: int,
-        occupied_now: defaultdict[Position, int],
+        occupied_now: Occupancy,
     ):
         print(f"clear operation for {agent1_id} at {node_v}")
 
@@ -390,8 +614,8 @@ class PushAndSwap:
         if len(unoccupied_nodes) >= 2:
             return True, plan, occupied_now
         # case 1
-        tmp_plan = deepcopy(plan)
-        tmp_occupied_now = deepcopy(occupied_now)
+        plan_checkpoint = plan.checkpoint()
+        occupied_checkpoint = occupied_now.checkpoint()
         for node_u in self.graph.neighbors(node_v):  # type: ignore
             unoccupied_nodes = get_unoccupied_nodes()
             if node_u in unoccupied_nodes:
@@ -406,8 +630,8 @@ class PushAndSwap:
             if is_empty:
                 if len(get_unoccupied_nodes()) >= 2:
                     return True, plan, occupied_now
-        plan = tmp_plan
-        occupied_now = tmp_occupied_now
+        plan.rollback(plan_checkpoint)
+        occupied_now.rollback(occupied_checkpoint)
         # case 2
         last_loc_s = plan.last(agent2_id)
         for node_u in self.graph.neighbors(node_v):  # type: ignore
@@ -494,8 +718,9 @@ class PushAndSwap:
         plan: Plan,
         agent_id: int,
         next_node: Position,
-        occupied_now: defaultdict[Position, int],
+        occupied_now: Occupancy,
     ):
+        self._check_budget()
         assert occupied_now[plan.last(agent_id)] == agent_id, "invalid update"
         assert occupied_now[next_node] == NIL, "vertex conflict"
 
@@ -503,9 +728,7 @@ class PushAndSwap:
         occupied_now[plan.last(agent_id)] = NIL
         occupied_now[next_node] = agent_id
         # update plan
-        c = plan.last()
-        c[agent_id] = next_node
-        plan.append(c)
+        plan.move(agent_id, next_node)
 
         return plan, occupied_now
 
@@ -514,20 +737,12 @@ class PushAndSwap:
         plan: Plan,
         node_v_current: Position,
         obstacles: list[Position],
-        occupied_now: defaultdict[Position, int],
+        occupied_now: Occupancy,
     ):
-        v_empty = self.get_nearest_empty_node(node_v_current, obstacles, occupied_now)
-        if v_empty is None:
+        p = self.get_path_to_nearest_empty_node(node_v_current, obstacles, occupied_now)
+        if p is None:
             return False, plan, occupied_now
 
-        def get_path() -> list[Position]:
-            G = self.graph.copy()
-            for obstacle in obstacles:
-                if obstacle in G:
-                    G.remove_node(obstacle)
-            return nx.shortest_path(G, node_v_current, v_empty)  # type: ignore
-
-        p: list[Position] = get_path()  # type: ignore
         for i in reversed(range(1, len(p))):
             assert occupied_now[p[i - 1]] != NIL, "node must be occupied"
             plan, occupied_now = self.update_plan(
@@ -538,6 +753,7 @@ class PushAndSwap:
     def get_shortest_path(self, agent_id: int, node_s: Position) -> Path:
         path = [node_s]
         node_g = self.agents[agent_id].target
+        dist_field = self.get_dist_field(node_g)
 
         while path[-1] != node_g:
             node_v = path[-1]
@@ -547,8 +763,8 @@ class PushAndSwap:
                 node_u: Position
                 if pre_node is None:
                     pre_node = node_u
-                c_a: int = nx.shortest_path_length(self.graph, node_u, node_g)  # type: ignore
-                c_b: int = nx.shortest_path_length(self.graph, pre_node, node_g)  # type: ignore
+                c_a = dist_field[node_u]
+                c_b = dist_field[pre_node]
                 if c_a != c_b:
                     next_node = node_u if c_a < c_b else pre_node
                     pre_node = next_node
@@ -564,90 +780,203 @@ class PushAndSwap:
             path.append(next_node)
         return Path(path)
 
+    def get_dist_field(self, target: Position) -> NDArray[np.int32]:
+        """targetからの最短距離をグリッド上の配列で返す (targetごとにキャッシュ)"""
+        dist_field = self._dist_fields.get(target)
+        if dist_field is not None:
+            self._dist_fields.move_to_end(target)
+            return dist_field
+        dist_field = self.graph.bfs(target)
+        self._dist_fields[target] = dist_field
+        if len(self._dist_fields) > DIST_FIELD_CACHE_SIZE:
+            self._dist_fields.popitem(last=False)
+        return dist_field
+
+    def get_dist(self, node_s: Position, node_g: Position) -> int:
+        return int(self.get_dist_field(node_g)[node_s])
+
+    def get_path_to_nearest_empty_node(
+        self,
+        node_v: Position,
+        obstacles: list[Position],
+        occupied_now: Occupancy,
+    ) -> list[Position] | None:
+        """obstaclesを避けてnode_vから最も近い空きノードまでの経路を探す"""
+        agent = self.agents[occupied_now[node_v]]
+        return self.graph.search(
+            node_v,
+            lambda node: occupied_now[node] == NIL,
+            obstacles,
+            sort_key=agent.get_dist,
+        )
+
     def get_nearest_empty_node(
         self,
         node_v: Position,
         obstacles: list[Position],
-        occupied_now: defaultdict[Position, int],
-    ) -> Position:
-        agent_id = occupied_now[node_v]
-        agent = self.agents[agent_id]
-        v_empty: Position | None = None
-        open_: deque[Position] = deque([node_v])
-        close_: defaultdict[Position, bool] = defaultdict(lambda: False)
-        for obs in obstacles:
-            close_[obs] = True
-        while open_:
-            node_u = open_.popleft()
-            if close_[node_u]:
-                continue
-            close_[node_u] = True
-            if occupied_now[node_u] == NIL:
-                v_empty = node_u
-                break
-            nodes_C: list[Position] = []
-            for neighbor in self.graph.neighbors(node_u):  # type: ignore
-                if close_[neighbor]:  # type: ignore
-                    continue
-                nodes_C.append(neighbor)  # type: ignore
-            nodes_C.sort(key=lambda node: agent.get_dist(node))
-            open_.extend(nodes_C)
-        return v_empty
+        occupied_now: Occupancy,
+    ) -> Position | None:
+        path = self.get_path_to_nearest_empty_node(node_v, obstacles, occupied_now)
+        if path is None:
+            return None
+        return path[-1]
 
     def find_nodes_with_many_neighbors(self):
-        self._nodes_with_many_neighbors = []
-        for node, degree in self.graph.degree():  # type: ignore
-            node: Position
-            degree: int
-            if degree >= 3:
-                self._nodes_with_many_neighbors.append(node)
+        self._nodes_with_many_neighbors = RingIndex(self.graph.degree() >= 3)
 
     def compress(self, plan: Plan, finish_func: Literal[all, any] = any):
-        temp_orders: dict[Position, deque[int]] = {node: deque([]) for node in self.graph.nodes}  # type: ignore
+        """各ノードを訪れる順番を保ったまま、待ち時間を詰めた計画を作る
+
+        エージェントが別のノードに入ることを「イベント」とし、ノードごとのイベントの並び
+        (到着時刻、エージェント番号順) をNumPyの並べ替えで求める。
+        イベントは自分の1つ前のイベントの次のステップ以降、かつ同じノードの直前の訪問者が
+        そのノードを出たステップ以降 (出た方のエージェント番号が大きければその次のステップ) に
+        起こせるので、各イベントが起こるステップを依存関係をたどって一度ずつ決める。
+        """
+        solution = plan.solution
         makespan = plan.get_makespan()
-        for t in range(makespan + 1):
-            for agent_id, agent in enumerate(self.agents):
-                node_v = plan.solution[t][agent_id]
-                if (
-                    len(temp_orders[node_v]) == 0
-                    or node_v != plan.solution[t - 1][agent_id]
-                ):
-                    temp_orders[node_v].append(agent_id)
-        new_plan = Plan([])
-        new_plan.append(plan.solution[0])
-        internal_clock = [0 for _ in range(self.n_agents)]
-        targets = [agent.target for agent in self.agents]
-
-        while not finish_func([p == t for p, t in zip(new_plan.last(), targets)]):
-            plan_t: Plan_t = []
-            for agent_id, agent in enumerate(self.agents):
-                t = internal_clock[agent_id]
-                if t == makespan:
-                    plan_t.append(new_plan.last(agent_id))
-                    continue
-                v_current = plan.solution[t][agent_id]
-                while t < makespan and v_current == plan.solution[t + 1][agent_id]:
-                    t += 1
-                internal_clock[agent_id] = t
+        n_agents = solution.shape[1]
+        cells = solution[..., 0].astype(np.int64) * self.graph.width + solution[..., 1]
+
+        # イベント (到着時刻, エージェント) を時刻、エージェント番号の順に並べる
+        is_event = np.ones(cells.shape, dtype=bool)
+        is_event[1:] = cells[1:] != cells[:-1]
+        event_t, event_agent = np.nonzero(is_event)
+        n_events = len(event_t)
+        # 同じエージェントの前後のイベント
+        by_agent = np.lexsort((event_t, event_agent))
+        same_agent = event_agent[by_agent[1:]] == event_agent[by_agent[:-1]]
+        prev_own = np.full(n_events, NIL)
+        next_own = np.full(n_events, NIL)
+        prev_own[by_agent[1:][same_agent]] = by_agent[:-1][same_agent]
+        next_own[by_agent[:-1][same_agent]] = by_agent[1:][same_agent]
+        # 同じノードで直前に到着したイベントと、そのエージェントがノードを出るイベント
+        event_cells = cells[event_t, event_agent]
+        by_node = np.argsort(event_cells, kind="stable")
+        same_node = event_cells[by_node[1:]] == event_cells[by_node[:-1]]
+        prev_visit = np.full(n_events, NIL)
+        prev_visit[by_node[1:][same_node]] = by_node[:-1][same_node]
+        has_prev_visit = prev_visit != NIL
+        leave = np.full(n_events, NIL)
+        leave[has_prev_visit] = next_own[prev_visit[has_prev_visit]]
+        # 出る方が先に処理される (番号が小さい) なら同じステップで入れる
+        delay = np.ones(n_events, dtype=np.int64)
+        delay[has_prev_visit] = (
+            event_agent[prev_visit[has_prev_visit]] >= event_agent[has_prev_visit]
+        )
 
-                if t == makespan:
-                    plan_t.append(new_plan.last(agent_id))
-                    continue
+        # 各イベントが起こるステップ (起こらないならnever)
+        never = np.iinfo(np.int64).max
+        step = self._schedule_events(
+            prev_own.tolist(), leave.tolist(), has_prev_visit.tolist(), delay.tolist(), never
+        )
 
-                v_next = plan.solution[t + 1][agent_id]
-                if temp_orders[v_next][0] == agent_id:
-                    plan_t.append(v_next)
-                    temp_orders[v_current].popleft()
-                    internal_clock[agent_id] = t + 1
+        # 最後のイベントの後、元の計画の終わりまで進んだステップで時計がmakespanに達する
+        last_events = by_agent[np.append(~same_agent, True)]
+        last_steps = step[last_events]
+        done = np.where(
+            last_steps == never, never, last_steps + (event_t[last_events] != makespan)
+        )
+        n_steps = int(done.max())
+        if n_steps == never:
+            n_steps = int(step[step != never].max())
+        occurs = step <= n_steps
+        index = np.full((n_steps + 1, n_agents), NIL)
+        index[step[occurs], event_agent[occurs]] = np.flatnonzero(occurs)
+        # イベント番号は各エージェントで時刻順に増えるので、累積最大が直近のイベントになる
+        index = np.maximum.accumulate(index, axis=0)
+        new_solution = solution[event_t[index], event_agent[index]]
+
+        targets = np.array(
+            [(NIL, NIL) if agent.target is None else agent.target for agent in self.agents]
+        )
+        # finish_funcを満たした最初のステップで打ち切る
+        at_target = (new_solution == targets).all(axis=2)
+        reached = np.flatnonzero(
+            at_target.any(axis=1) if finish_func is any else at_target.all(axis=1)
+        )
+        if len(reached) > 0:
+            n_steps = min(n_steps, int(reached[0]))
+        else:
+            assert int(done.max()) != never, "compress does not terminate"
+        return Plan(new_solution[: n_steps + 1])
+
+    @staticmethod
+    def _schedule_events(
+        prev_own: list[int],
+        leave: list[int],
+        has_prev_visit: list[bool],
+        delay: list[int],
+        never: int,
+    ) -> NDArray[np.int64]:
+        """step[e] = max(step[prev_own[e]] + 1, step[leave[e]] + delay[e])を依存順に解く
+
+        待ち合わせが循環するイベントと、それに依存するイベントはnever。
+        """
+        n_events = len(prev_own)
+        step = [NIL] * n_events
+        on_stack = [False] * n_events
+        for root in range(n_events):
+            if step[root] != NIL:
+                continue
+            stack = [root]
+            on_stack[root] = True
+            while stack:
+                event = stack[-1]
+                own = prev_own[event]
+                if own != NIL and step[own] == NIL and not on_stack[own]:
+                    stack.append(own)
+                    on_stack[own] = True
+                    continue
+                other = leave[event]
+                if other != NIL and step[other] == NIL and not on_stack[other]:
+                    stack.append(other)
+                    on_stack[other] = True
+                    continue
+                if own == NIL:
+                    value = 0
+                elif step[own] == NIL or step[own] == never:
+                    value = never
                 else:
-                    plan_t.append(new_plan.last(agent_id))
-            new_plan.append(plan_t)
-        return new_plan
-
-    def create_graph(self, map_: NDArray[np.uint8]):
-        G: Graph = nx.grid_2d_graph(map_.shape[0], map_.shape[1])  # type: ignore
-        for i in range(map_.shape[0]):
-            for j in range(map_.shape[1]):
-                if map_[i, j] == 1:
-                    G.remove_node((i, j))  # type: ignore
-        return G
+                    value = step[own] + 1
+                if has_prev_visit[event] and value != never:
+                    if other == NIL or step[other] == NIL or step[other] == never:
+                        # 直前の訪問者がノードを出ないか、互いに待っている
+                        value = never
+                    else:
+                        value = max(value, step[other] + delay[event])
+                step[event] = value
+                on_stack[event] = False
+                stack.pop()
+        return np.array(step, dtype=np.int64)
+
+
+_portfolio_solver: PushAndSwap | None = None
+
+
+def _init_portfolio_worker(solver: PushAndSwap) -> None:
+    global _portfolio_solver
+    _portfolio_solver = solver
+
+
+def _run_portfolio_worker(
+    name: str, agent_order: list[int], deadline: float | None
+) -> tuple[str, NDArray[np.int32] | None, list[int], bool, float]:
+    assert _portfolio_solver is not None, "worker is not initialized"
+    start = time.perf_counter()
+    time_limit = None if deadline is None else max(deadline - time.time(), 0.0)
+    # run()は到着したエージェントのtargetを消すので、次の計画順のために戻す
+    targets = [agent.target for agent in _portfolio_solver.agents]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            result = _portfolio_solver.run(
+                time_limit=time_limit, agent_order=agent_order
+            )
+        finally:
+            for agent, target in zip(_portfolio_solver.agents, targets):
+                agent.target = target
+    elapsed = time.perf_counter() - start
+    if result is None:
+        return name, None, [], _portfolio_solver.timed_out, elapsed
+    solution, finished_agents = result
+    return name, solution, finished_agents, _portfolio_solver.timed_out, elapsed
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import heapq
+from typing import NamedTuple
+
+from behavior_opt.a_star.grid_graph import NIL, UNREACHABLE, GridGraph, PathOracle
+from behavior_opt.a_star.task_assignment import TaskAssignment
+from behavior_opt.sh_core import Agent, Item, Name, Objective, Position
+
+# 1区間の計画で先読みするtargetの数の上限
+MAX_LOOKAHEAD = 8
+# 計画できないエージェントの優先順位を上げてやり直す回数の上限
+MAX_RESTARTS = 10
+# 1エージェントの時空間A*で展開する状態数の上限 (horizon 1ステップあたり)
+EXPANSIONS_PER_STEP = 100
+# 全エージェントが動かない区間がこの数だけ続いたら行き詰まりとする
+MAX_STALLED_WINDOWS = 20
+
+
+class Leg(NamedTuple):
+    """1つのtargetに着くまでの経路 (待機を含む) と、そこで行うアクション"""
+
+    path: list[Position]
+    action: Objective
+    item: Item | None
+
+
+class ReservationTable:
+    """区間内の時刻ごとのセルと辺の予約
+
+    時刻は区間の開始を0とする。staticとblockedに入れたセルはすべての時刻で予約済みとして扱う。
+    blockedはclearで消える。
+    予約に阻まれたときは、その予約を持つエージェントをblockersに記録する。
+    """
+
+    def __init__(self) -> None:
+        self._vertices: dict[tuple[int, int], Name] = {}
+        self._edges: dict[tuple[int, int, int], Name] = {}
+        self.static: set[int] = set()
+        self.blocked: set[int] = set()
+        self.blockers: set[Name] = set()
+
+    def clear(self) -> None:
+        self._vertices.clear()
+        self._edges.clear()
+        self.blocked.clear()
+        self.blockers.clear()
+
+    def is_free(self, node_id: int, t: int) -> bool:
+        if node_id in self.static or node_id in self.blocked:
+            return False
+        owner = self._vertices.get((t, node_id))
+        if owner is not None:
+            self.blockers.add(owner)
+            return False
+        return True
+
+    def can_move(self, from_id: int, to_id: int, t: int) -> bool:
+        """時刻tからt+1にfrom_idからto_idへ動けるか (入れ替わりを禁止する)"""
+        if not self.is_free(to_id, t + 1):
+            return False
+        owner = self._edges.get((t, to_id, from_id))
+        if owner is not None:
+            self.blockers.add(owner)
+            return False
+        return True
+
+    def can_stay(self, node_id: int, t_from: int, t_to: int) -> bool:
+        return all(self.is_free(node_id, t) for t in range(t_from, t_to + 1))
+
+    def reserve(self, name: Name, path: list[int]) -> None:
+        """時刻0からのnameの経路を予約する"""
+        for t, node_id in enumerate(path):
+            self._vertices[(t, node_id)] = name
+            if t > 0 and path[t - 1] != node_id:
+                self._edges[(t - 1, path[t - 1], node_id)] = name
+
+
+class RollingHorizonPlanner:
+    """Rolling-Horizon Collision Resolutionの考え方で、衝突しない経路を区間ごとに計画する
+
+    window (W) ステップごとに、全エージェントの次のhorizon (H) ステップを優先度順の
+    時空間A*と予約表で衝突なしに計画し、先頭のWステップだけを実行する。
+    H ステップより先は他のエージェントを無視した距離で見積もるので、1区間の計算量は
+    エージェント数とHで抑えられる。
+    targetの割り当てはtask_assignment.set_targetに従い、targetに着くごとにLegを記録する。
+    """
+
+    def __init__(
+        self,
+        graph: GridGraph,
+        task_assignment: TaskAssignment,
+        agents: list[Agent],
+        window: int = 5,
+        horizon: int = 20,
+        max_steps: int = 100000,
+        path_oracle: PathOracle | None = None,
+    ) -> None:
+        assert 0 < window <= horizon, f"invalid window: {window} (horizon {horizon})"
+        self.graph = graph
+        self.path_oracle = path_oracle if path_oracle is not None else PathOracle(graph)
+        self.task_assignment = task_assignment
+        self.agents = agents
+        self.window = window
+        self.horizon = horizon
+        self.max_steps = max_steps
+        self.reservations = ReservationTable()
+        # 失敗したエージェントを繰り上げた優先順位は次の区間にも引き継ぐ
+        self._priorities: list[Name] = [agent.name for agent in agents]
+        self.legs: dict[Name, list[Leg]] = {agent.name: [] for agent in agents}
+        self._leg_paths: dict[Name, list[Position]] = {
+            agent.name: [agent.pos] for agent in agents
+        }
+        self.max_expansions = EXPANSIONS_PER_STEP * horizon
+        self.n_steps = 0
+        self.n_restarts = 0
+        self.n_fallbacks = 0
+
+    def run(self) -> dict[Name, list[Leg]]:
+        self._remove_docked_agents()
+        self.task_assignment.set_target()
+        for agent in list(self.agents):
+            self._arrive(agent)
+        n_stalled = 0
+        while len(self.agents) > 0:
+            if self.n_steps >= self.max_steps:
+                raise RuntimeError(f"rolling horizon planning exceeded {self.max_steps} steps")
+            plans = self.plan_window()
+            if all(len(set(path[: self.window + 1])) == 1 for path in plans.values()):
+                n_stalled += 1
+                if n_stalled >= MAX_STALLED_WINDOWS:
+                    raise RuntimeError(
+                        f"rolling horizon planning deadlocked at step {self.n_steps}"
+                        f" ({len(self.agents)} agents left)"
+                    )
+            else:
+                n_stalled = 0
+            for t in range(1, self.window + 1):
+                for agent in list(self.agents):
+                    agent.pos = self.graph.to_position(plans[agent.name][t])
+                    self._leg_paths[agent.name].append(agent.pos)
+                self.n_steps += 1
+                for agent in list(self.agents):
+                    self._arrive(agent)
+                if len(self.agents) == 0:
+                    break
+        return self.legs
+
+    def _remove_docked_agents(self) -> None:
+        # a_star.planningと同じく、DOCKだけが残りgoalにいるエージェントは終了とする
+        for agent in list(self.agents):
+            actions = self.task_assignment.actions[agent.name]
+            if len(actions) == 1 and agent.pos == agent.goal.pos:
+                self._finish(agent)
+
+    def _finish(self, agent: Agent) -> None:
+        del self.task_assignment.actions[agent.name]
+        del self.task_assignment.assigned_tasks[agent.name]
+        self.agents.remove(agent)
+        self._priorities.remove(agent.name)
+        # 終了したエージェントはその場に留まるので障害物として扱う
+        self.reservations.static.add(self.graph.to_id(agent.pos))
+
+    def _arrive(self, agent: Agent) -> None:
+        """targetに着いていればLegを記録して次のtargetを割り当てる (着いた先が次のtargetでも続ける)"""
+        while agent.target is not None and agent.pos == agent.target:
+            name = agent.name
+            self.legs[name].append(
+                Leg(
+                    path=self._leg_paths[name],
+                    action=self.task_assignment.current_action[name],
+                    item=None
+                    if self.task_assignment.current_task[name] is None
+                    else self.task_assignment.current_task[name].item,
+                )
+            )
+            self._leg_paths[name] = [agent.pos]
+            agent.target = None
+            actions = self.task_assignment.actions[name]
+            if len(actions) == 1 and agent.pos == agent.goal.pos:
+                self._finish(agent)
+                return
+            self.task_assignment.set_target()
+
+    def plan_window(self) -> dict[Name, list[int]]:
+        """全エージェントの時刻0からhorizonまでのノード番号列を衝突なしに計画する
+
+        計画できないエージェントがいれば、そのエージェントを阻んだエージェントのうち
+        最も優先順位の低いものの直前に繰り上げてやり直す (阻んだエージェントがいなければ最優先にする)。
+        それでも計画できなければ、まだ計画していないエージェントのいるセルを避けて計画する。
+        この場合はどのエージェントもその場に留まれるので、必ず計画できる。
+        """
+        agents = {agent.name: agent for agent in self.agents}
+        for _ in range(MAX_RESTARTS):
+            plans, failed, blockers = self._plan_in_order(agents)
+            if failed is None:
+                return plans
+            self.n_restarts += 1
+            self._priorities.remove(failed)
+            index = max((self._priorities.index(name) for name in blockers), default=0)
+            self._priorities.insert(index, failed)
+        self.n_fallbacks += 1
+        plans, _, _ = self._plan_in_order(agents, avoid_unplanned=True)
+        return plans
+
+    def _plan_in_order(
+        self, agents: dict[Name, Agent], avoid_unplanned: bool = False
+    ) -> tuple[dict[Name, list[int]], Name | None, set[Name]]:
+        """優先順位の順に計画し、(計画, 計画できなかったエージェント, それを阻んだエージェント) を返す"""
+        self.reservations.clear()
+        if avoid_unplanned:
+            self.reservations.blocked.update(self.graph.to_id(agent.pos) for agent in agents.values())
+        plans: dict[Name, list[int]] = {}
+        for name in self._priorities:
+            start = self.graph.to_id(agents[name].pos)
+            self.reservations.blocked.discard(start)
+            self.reservations.blockers.clear()
+            path = self._plan_agent(agents[name])
+            if path is None:
+                if not avoid_unplanned:
+                    return plans, name, set(self.reservations.blockers)
+                path = [start] * (self.horizon + 1)
+            self.reservations.reserve(name, path)
+            plans[name] = path
+        return plans, None, set()
+
+    def _goals(self, agent: Agent) -> tuple[list[int], bool]:
+        """今のtargetから、静的な距離の合計がhorizonを超えるまでの先のtargetと、
+        最後のtargetがDOCK (着いたら終了) かどうか
+        """
+        assert agent.target is not None, f"{agent.name} has no target"
+        targets = [(self.task_assignment.current_action[agent.name], agent.target)]
+        targets += self.task_assignment.peek_targets(agent, MAX_LOOKAHEAD)
+        goals = [self.graph.to_id(agent.target)]
+        total = int(self.path_oracle.dist_field(agent.target)[self.graph.to_id(agent.pos)])
+        for _, target in targets[1:]:
+            if total > self.horizon:
+                break
+            total += int(self.path_oracle.dist_field(target)[goals[-1]])
+            goals.append(self.graph.to_id(target))
+        return goals, targets[len(goals) - 1][0] == Objective.DOCK
+
+    def _plan_agent(self, agent: Agent) -> list[int] | None:
+        """予約を避ける時空間A*で、goalsを順にたどる時刻0からhorizonまでの経路を探す
+
+        状態は(ノード, 時刻, 次のgoalの番号)。horizonに達した状態は、残りを静的な距離で
+        見積もった値をコストとする終端にする。すべてのgoalに着いてhorizonまで留まれる状態も終端。
+        最後のgoalがDOCKなら、着いた後はhorizonまで留まれる場合にだけ入る。
+        """
+        horizon = self.horizon
+        graph = self.graph
+        reservations = self.reservations
+        goals, docking = self._goals(agent)
+        n_goals = len(goals)
+        dists = [self.path_oracle.dist_field(graph.to_position(goal)) for goal in goals]
+        # remaining[k]: goals[k]から最後のgoalまでの距離
+        remaining = [0] * n_goals
+        for k in range(n_goals - 2, -1, -1):
+            remaining[k] = remaining[k + 1] + int(dists[k + 1][goals[k]])
+
+        def advance(node_id: int, k: int) -> int:
+            while k < n_goals and node_id == goals[k]:
+                k += 1
+            return k
+
+        def heuristic(node_id: int, k: int) -> int:
+            if k == n_goals:
+                return 0
+            dist = int(dists[k][node_id])
+            return NIL if dist == UNREACHABLE else dist + remaining[k]
+
+        start = graph.to_id(agent.pos)
+        start_state = (start, 0, advance(start, 0))
+        h = heuristic(start, start_state[2])
+        if h == NIL:
+            return None
+        open_: list[tuple[int, int, int, tuple[int, int, int]]] = []
+        heapq.heappush(open_, (h, h, 0, start_state))
+        parents: dict[tuple[int, int, int], tuple[int, int, int] | None] = {start_state: None}
+        counter = 0
+        n_expanded = 0
+        while open_ and n_expanded < self.max_expansions:
+            n_expanded += 1
+            _, _, _, state = heapq.heappop(open_)
+            node_id, t, k = state
+            self.graph.n_expanded += 1
+            if t == horizon or (k == n_goals and reservations.can_stay(node_id, t, horizon)):
+                path = []
+                cur: tuple[int, int, int] | None = state
+                while cur is not None:
+                    path.append(cur[0])
+                    cur = parents[cur]
+                path.reverse()
+                # 終端より先はその場に留まる
+                return path + [node_id] * (horizon + 1 - len(path))
+            children = graph.indices[graph.indptr[node_id] : graph.indptr[node_id + 1]].tolist()
+            for child in [node_id] + children:
+                if child == node_id:
+                    if not reservations.is_free(child, t + 1):
+                        continue
+                elif not reservations.can_move(node_id, child, t):
+                    continue
+                child_k = advance(child, k)
+                if (
+                    docking
+                    and child_k == n_goals
+                    and k < n_goals
+                    and not reservations.can_stay(child, t + 1, horizon)
+                ):
+                    # DOCKに着くとその場で終了するので、horizonまで留まれないときは入れない
+                    continue
+                child_state = (child, t + 1, child_k)
+                if child_state in parents:
+                    # 時刻が状態に含まれるので、最初に見つけた親で経路長は変わらない
+                    continue
+                h = heuristic(child, child_k)
+                if h == NIL:
+                    continue
+                parents[child_state] = state
+                counter += 1
+                heapq.heappush(open_, (t + 1 + h, h, counter, child_state))
+        return None
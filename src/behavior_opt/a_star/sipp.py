@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import heapq
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+
+from behavior_opt.a_star.grid_graph import UNREACHABLE, GridGraph, PathOracle
+from behavior_opt.sh_core import Agent, Name, Position
+
+# 終わりのない区間の終端
+INF = np.iinfo(np.int64).max
+# 計画できないエージェントを最優先にしてやり直す回数の上限 (エージェント数あたり)
+RESTARTS_PER_AGENT = 1
+# リストで保持する距離場のセル数の合計 (1セルあたり8 byte)
+DIST_LIST_CACHE_CELLS = 1 << 23
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+class SafeIntervalTable:
+    """セルごとの予約済み区間から、安全区間 (誰もいない連続した時刻) を引く
+
+    予約済み区間は重ならず隣り合わないように併合し、開始時刻順に並べて持つ。
+    安全区間は予約済み区間の隙間で、セルの中で時刻順にi = 0, 1, ...と番号を振る
+    (i番目の安全区間はi番目の予約済み区間の直前)。
+    入れ替わりを禁止するため、移動した辺も(出発時刻, 移動元, 移動先)でedgesに予約する。
+    """
+
+    def __init__(self) -> None:
+        self._starts: dict[int, list[int]] = {}
+        self._ends: dict[int, list[int]] = {}
+        self.edges: set[tuple[int, int, int]] = set()
+
+    def reserve(self, node_id: int, start: int, end: int) -> None:
+        """node_idを時刻start..end (両端を含む) で予約する"""
+        starts = self._starts.setdefault(node_id, [])
+        ends = self._ends.setdefault(node_id, [])
+        # startの直前の区間から、endの直後までの区間を1つにまとめる
+        lo = bisect_right(ends, start - 2)
+        hi = bisect_right(starts, end + 1)
+        if lo < hi:
+            start = min(start, starts[lo])
+            end = max(end, ends[hi - 1])
+        starts[lo:hi] = [start]
+        ends[lo:hi] = [end]
+
+    def reserve_path(self, path: list[int], hold: bool = True) -> None:
+        """時刻0からの経路を予約する (holdなら最後のセルに以後ずっと留まる)"""
+        t_enter = 0
+        for t in range(1, len(path) + 1):
+            if t == len(path) or path[t] != path[t - 1]:
+                end = INF if t == len(path) and hold else t - 1
+                self.reserve(path[t - 1], t_enter, end)
+                if t < len(path):
+                    self.edges.add((t - 1, path[t - 1], path[t]))
+                t_enter = t
+
+    def reserved(self, node_id: int) -> tuple[list[int], list[int]]:
+        """node_idの予約済み区間の(開始時刻のリスト, 終了時刻のリスト)"""
+        starts = self._starts.get(node_id)
+        if starts is None:
+            return [], []
+        return starts, self._ends[node_id]
+
+    def safe_interval(self, node_id: int, i: int) -> tuple[int, int]:
+        """node_idのi番目の安全区間 (両端を含む、空なら開始 > 終端)"""
+        starts = self._starts.get(node_id)
+        if not starts:
+            return 0, INF
+        ends = self._ends[node_id]
+        start = 0 if i == 0 else ends[i - 1] + 1
+        end = INF if i == len(starts) else starts[i] - 1
+        return start, end
+
+    def interval_index(self, node_id: int, t: int) -> int | None:
+        """時刻tを含む安全区間の番号 (tが予約済みならNone)"""
+        starts = self._starts.get(node_id)
+        if not starts:
+            return 0
+        i = bisect_right(starts, t)
+        if i > 0 and t <= self._ends[node_id][i - 1]:
+            return None
+        return i
+
+
+class SIPP:
+    """Safe Interval Path Planningによる優先度順の経路計画
+
+    優先順位の高いエージェントから順に、SafeIntervalTableの(セル, 安全区間)を状態とする
+    A*で経路を求め、targetに着いたら以後そこに留まるものとして予約する。
+    待機は状態に含めないので、待ち時間の長さに関係なく状態数はセルと区間の数で決まる。
+    PushAndSwapと同じく、いずれかのエージェントがtargetに着いたステップまでの計画を返す。
+    """
+
+    def __init__(
+        self,
+        agents: list[Agent],
+        world_map: NDArray[Any],
+        enable_dist_init: bool = True,
+    ) -> None:
+        self.SOLVER_NAME = "SIPP"
+        self.agents = agents
+        self.n_agents = len(agents)
+        self.graph = GridGraph.from_map(world_map)
+        self.path_oracle = PathOracle(self.graph)
+        # 探索の内側ではNumPy配列よりリストの方が速いので、隣接と距離場をリストで持つ
+        self._neighbors: list[list[int]] = [
+            self.graph.indices[self.graph.indptr[i] : self.graph.indptr[i + 1]].tolist()
+            for i in range(len(self.graph.indptr) - 1)
+        ]
+        self._dist_lists: OrderedDict[Position, list[int]] = OrderedDict()
+        self.enable_dist_init = enable_dist_init
+        # 呼び出し側で減ったエージェントはその場に留まるので、以後は障害物として扱う
+        self._known_agents: dict[Name, Agent] = {agent.name: agent for agent in agents}
+        self.timed_out = False
+        self.n_restarts = 0
+        self._deadline: float | None = None
+        self._max_expansions: int | None = None
+
+    def run(
+        self,
+        time_limit: float | None = None,
+        max_expansions: int | None = None,
+        agent_order: list[int] | None = None,
+    ):
+        """全エージェントをtargetまで動かす計画を立てる
+
+        time_limit[秒]または探索ノード数max_expansionsを超えた場合は、
+        その場に留まるだけの計画を返し、self.timed_outをTrueにする。
+        agent_orderを指定した場合はその順を初期の優先順位とする。
+        """
+        assert None not in [agent.target for agent in self.agents], "invalid target"
+        self.n_agents = len(self.agents)
+        self.timed_out = False
+        self._deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self._max_expansions = (
+            None if max_expansions is None else self.graph.n_expanded + max_expansions
+        )
+        agent_ids = list(range(self.n_agents))
+        if agent_order is not None:
+            assert sorted(agent_order) == agent_ids, "invalid agent order"
+            agent_ids = list(agent_order)
+        elif self.enable_dist_init:
+            agent_ids.sort(
+                key=lambda agent_id: self.get_dist(
+                    self.agents[agent_id].pos, self.agents[agent_id].target  # type: ignore
+                )
+            )
+
+        starts = [self.graph.to_id(agent.pos) for agent in self.agents]
+        try:
+            for n_restarts in range(RESTARTS_PER_AGENT * self.n_agents + 1):
+                paths, failed = self._plan_in_order(agent_ids)
+                if failed is None:
+                    break
+                self.n_restarts += 1
+                agent_ids.remove(failed)
+                agent_ids.insert(0, failed)
+            else:
+                raise RuntimeError(f"SIPP: agent-{failed} has no collision-free path")
+            # 1ラウンドに1行だけ出す (エージェントごとに出すと台数が多いときに埋もれる)
+            print(
+                f"{self.n_agents} agents planned, restarts: {n_restarts}, "
+                f"arrival: {max(len(path) for path in paths) - 1}"
+            )
+        except _BudgetExceeded as e:
+            self.timed_out = True
+            print(f"{e} exceeded")
+            paths = [[start] for start in starts]
+
+        # 全員がtargetに留まるまでの(T, n_agents, 2)の計画
+        makespan = max(len(path) for path in paths)
+        node_ids = np.array(
+            [path + [path[-1]] * (makespan - len(path)) for path in paths], dtype=np.int64
+        ).T
+        solution = np.stack(
+            [node_ids // self.graph.width, node_ids % self.graph.width], axis=2
+        ).astype(np.int32)
+        # いずれかのエージェントがtargetに着いた最初のステップで打ち切る
+        # (全員が仮のtargetに向かった場合は最後まで使う)
+        targets = np.array([agent.target for agent in self.agents], dtype=np.int32)
+        reached = np.flatnonzero((solution == targets).all(axis=2).any(axis=1))
+        if len(reached) > 0:
+            solution = solution[: int(reached[0]) + 1]
+
+        finished_agents: list[int] = []
+        for agent_id, agent in enumerate(self.agents):
+            if Position(*solution[-1, agent_id].tolist()) == agent.target:
+                print(f"agent-{agent_id} finished")
+                agent.target = None
+                finished_agents.append(agent_id)
+        return solution, finished_agents
+
+    def _plan_in_order(self, agent_ids: list[int]) -> tuple[list[list[int]], int | None]:
+        """優先順位の順に計画し、(エージェントごとの経路, 計画できなかったエージェント) を返す"""
+        table = SafeIntervalTable()
+        names = {agent.name for agent in self.agents}
+        for agent in self._known_agents.values():
+            if agent.name not in names:
+                table.reserve(self.graph.to_id(agent.pos), 0, INF)
+        paths: list[list[int]] = [[] for _ in range(self.n_agents)]
+        held_targets: set[Position] = set()
+        for agent_id in agent_ids:
+            agent = self.agents[agent_id]
+            target: Position = agent.target  # type: ignore
+            if agent.pos != target:
+                # PushAndSwapと同じく、他のエージェントが留まるtargetの手前を仮のtargetにする
+                while target in held_targets and target != agent.pos:
+                    target = Position(*self.path_oracle.shortest_path(agent.pos, target)[-2])
+            held_targets.add(target)
+            path = self.find_path(table, agent.pos, target)
+            if path is None:
+                return paths, agent_id
+            table.reserve_path(path)
+            paths[agent_id] = path
+        return paths, None
+
+    def _check_budget(self) -> None:
+        if self._deadline is not None and time.perf_counter() > self._deadline:
+            raise _BudgetExceeded("time limit")
+        if (
+            self._max_expansions is not None
+            and self.graph.n_expanded > self._max_expansions
+        ):
+            raise _BudgetExceeded("node expansion limit")
+
+    def find_path(
+        self, table: SafeIntervalTable, source: Position, target: Position
+    ) -> list[int] | None:
+        """sourceから時刻0に出発してtargetに着き、以後そこに留まれる最も早い経路
+
+        状態は(セル, 安全区間の番号)で、gはその区間に最も早く入れる時刻。
+        経路は時刻0からのノード番号列 (待機は同じノードの繰り返し)。見つからなければNone。
+        """
+        graph = self.graph
+        dist = self._dist_list(target)
+        neighbors = self._neighbors
+        reserved = table.reserved
+        edges = table.edges
+        source_id = graph.to_id(source)
+        target_id = graph.to_id(target)
+        start_i = table.interval_index(source_id, 0)
+        if start_i is None or dist[source_id] == UNREACHABLE:
+            return None
+        start_state = (source_id, start_i)
+        arrival: dict[tuple[int, int], int] = {start_state: 0}
+        parents: dict[tuple[int, int], tuple[int, int] | None] = {start_state: None}
+        open_: list[tuple[int, int, int, tuple[int, int]]] = []
+        h = dist[source_id]
+        heapq.heappush(open_, (h, h, 0, start_state))
+        counter = 0
+        closed: set[tuple[int, int]] = set()
+        while open_:
+            _, _, _, state = heapq.heappop(open_)
+            if state in closed:
+                continue
+            closed.add(state)
+            node_id, i = state
+            t = arrival[state]
+            _, end = table.safe_interval(node_id, i)
+            if node_id == target_id and end == INF:
+                return self._build_path(parents, arrival, state)
+            graph.n_expanded += 1
+            self._check_budget()
+            # node_idでendまで待てるので、隣にはt+1..end+1に入れる
+            latest = end + 1
+            for child in neighbors[node_id]:
+                h = dist[child]
+                if h == UNREACHABLE:
+                    continue
+                starts, ends = reserved(child)
+                # t+1以降を含む最初の安全区間から、latestまでに始まる区間を順に調べる
+                child_i = bisect_right(starts, t + 1)
+                n_intervals = len(starts) + 1
+                while child_i < n_intervals:
+                    child_start = 0 if child_i == 0 else ends[child_i - 1] + 1
+                    if child_start > latest:
+                        break
+                    child_end = INF if child_i == len(starts) else starts[child_i] - 1
+                    t_last = min(child_end, latest)
+                    t_child = max(t + 1, child_start)
+                    while t_child <= t_last and (t_child - 1, child, node_id) in edges:
+                        t_child += 1
+                    if t_child <= t_last:
+                        child_state = (child, child_i)
+                        if child_state not in closed and t_child < arrival.get(child_state, INF):
+                            arrival[child_state] = t_child
+                            parents[child_state] = state
+                            counter += 1
+                            heapq.heappush(open_, (t_child + h, h, counter, child_state))
+                    child_i += 1
+        return None
+
+    @staticmethod
+    def _build_path(
+        parents: dict[tuple[int, int], tuple[int, int] | None],
+        arrival: dict[tuple[int, int], int],
+        state: tuple[int, int],
+    ) -> list[int]:
+        # (ノード, 到着時刻) の列を、出発直前まで待つノード番号列に展開する
+        visits: list[tuple[int, int]] = []
+        cur: tuple[int, int] | None = state
+        while cur is not None:
+            visits.append((cur[0], arrival[cur]))
+            cur = parents[cur]
+        visits.reverse()
+        path: list[int] = []
+        for (node_id, _), (_, t_next) in zip(visits, visits[1:]):
+            path += [node_id] * (t_next - len(path))
+        path.append(visits[-1][0])
+        return path
+
+    def _dist_list(self, target: Position) -> list[int]:
+        dist = self._dist_lists.get(target)
+        if dist is not None:
+            self._dist_lists.move_to_end(target)
+            return dist
+        dist = self.path_oracle.dist_field(target).tolist()
+        self._dist_lists[target] = dist
+        if len(self._dist_lists) * len(dist) > DIST_LIST_CACHE_CELLS:
+            self._dist_lists.popitem(last=False)
+        return dist
+
+    def get_dist(self, node_s: Position, node_g: Position) -> int:
+        return int(self.path_oracle.dist_field(node_g)[self.graph.to_id(node_s)])
@@ -3,7 +3,20 @@ from enum import Enum
 
 import numpy as np
 
-from behavior_opt.sh_core import Agents, Position, Task, Tasks, World, Agent, Objective
+from behavior_opt.a_star.auction import UNASSIGNED, auction
+from behavior_opt.a_star.batching import build_batches, route_length, split_route, trips_length
+from behavior_opt.a_star.grid_graph import BucketIndex
+from behavior_opt.sh_core import (
+    UNREACHABLE_DIST,
+    Agents,
+    Name,
+    Position,
+    Task,
+    Tasks,
+    World,
+    Agent,
+    Objective,
+)
 
 
 class TaskAssignment:
@@ -47,46 +60,237 @@ class TaskAssignment:
                         self.current_action[agent.name] = Objective.DOCK
                         assigned_actions.append(Objective.DOCK)
 
+    def peek_targets(self, agent: Agent, n: int) -> list[tuple[Objective, Position]]:
+        """set_targetがこの先agentに割り当てる(アクション, target)を最大n件返す (割り当ては変えない)
+
+        DOCKの後は同じtargetが続くので、DOCKで打ち切る。
+        """
+        targets: list[tuple[Objective, Position]] = []
+        assigned_tasks = self.assigned_tasks[agent.name]
+        task_id = 0
+        for action in self.actions[agent.name]:
+            if len(targets) >= n:
+                break
+            if action == Objective.PICK_UP:
+                targets.append((action, assigned_tasks[task_id].item.end_point.pos))
+                task_id += 1
+            elif action == Objective.DROP_OFF:
+                pos = assigned_tasks[task_id].target_store_point.end_point.pos
+                targets.append((action, pos))
+                task_id += 1
+            elif action == Objective.DOCK:
+                targets.append((action, agent.goal.pos))
+                break
+        return targets
+
 
 class NearestTaskAssignment(TaskAssignment):
+    """エージェントごとに、今いる位置から歩行距離が最も近いタスクを順に割り当てる"""
+
     def __init__(self, world: World) -> None:
         super().__init__(world)
+        self.world = world
 
     def assign(self) -> None:
-        tasks = deepcopy(self.tasks)
+        # 割り当て済みのタスクは索引から消すだけなので、self.tasksはコピーしない
+        tasks = self.tasks
+        task_index = BucketIndex(task.item.end_point.pos for task in tasks)
+        self._first_tasks: dict[Name, Task] = {}
+        for task in tasks:
+            self._first_tasks.setdefault(task.item.name, task)
         agents = deepcopy(self.agents)
-        while len(tasks) > 0:
+        # エージェントが運んでいるアイテム名と個数 (Items.addと同じく最初に拾った順)
+        carrying: dict[Name, dict[Name, int]] = {agent.name: {} for agent in agents}
+        while len(task_index) > 0:
             for agent_id, agent in enumerate(agents):
-                if len(tasks) == 0:
+                if len(task_index) == 0:
                     break
-                task, _ = self.get_nearest_task(agent.pos, tasks)
+                task_id, _ = self.get_nearest_task(agent.pos, task_index)
+                task = tasks[task_id]
                 tmp_volume = agent.volume + task.item.volume
                 if tmp_volume <= agent.capacity:
                     self.assigned_tasks[agent.name].append(task)
                     self.actions[agent.name].append(Objective.PICK_UP)
                     agent.volume = tmp_volume
                     agent.pos = task.item.end_point.pos
-                    agent.having_items.add(task.item)
-                    tasks.remove(task)
+                    items = carrying[agent.name]
+                    items[task.item.name] = items.get(task.item.name, 0) + 1
+                    task_index.remove(task_id)
                 else:
-                    self.go_to_store_point(agent)
+                    self.go_to_store_point(agent, carrying[agent.name])
         for agent_id, agent in enumerate(agents):
-            self.go_to_store_point(agent)
+            self.go_to_store_point(agent, carrying[agent.name])
             self.actions[agents[agent_id].name].append(Objective.DOCK)
 
-    def go_to_store_point(self, agent: Agent) -> None:
-        while item := agent.having_items.pop(0):
-            task: Task = self.tasks[item.name]
-            self.assigned_tasks[agent.name].append(task)
-            self.actions[agent.name].append(Objective.DROP_OFF)
-            agent.volume -= task.item.volume
-            agent.pos = task.target_store_point.end_point.pos
-
-    def get_nearest_task(self, agent_pos: Position, tasks: Tasks) -> tuple[Task, int]:
-        item_dists = [task.item.get_dist(agent_pos) for task in tasks]
-        nearest_task = tasks[np.argmin(item_dists)]  # type: ignore
-        nearest_task_dist = nearest_task.item.get_dist(agent_pos)
-        return nearest_task, nearest_task_dist
+    def go_to_store_point(self, agent: Agent, items: dict[Name, int]) -> None:
+        """運んでいるアイテムをすべて降ろす (itemsは空になる)"""
+        for item_name, amount in items.items():
+            # 同じアイテム名のタスクが複数あるときは、self.tasks[item_name]と同じく最初のもの
+            task: Task = self._first_tasks[item_name]
+            for _ in range(amount):
+                self.assigned_tasks[agent.name].append(task)
+                self.actions[agent.name].append(Objective.DROP_OFF)
+                agent.volume -= task.item.volume
+                agent.pos = task.target_store_point.end_point.pos
+        items.clear()
+
+    def get_nearest_task(self, agent_pos: Position, task_index: BucketIndex) -> tuple[int, int]:
+        """agent_posからアイテムのエンドポイントまでの歩行距離が最も近い未割り当てタスクの
+        (self.tasksでの番号, 距離)
+
+        同じ距離のタスクはself.tasksで前にあるものを選ぶ。
+        """
+        dists = self.world.dists_from(agent_pos)
+        end_point_ids = self.world.end_point_ids
+        nearest = task_index.nearest(agent_pos, lambda pos: int(dists[end_point_ids[pos]]))
+        assert nearest is not None, "no task left"
+        return nearest
+
+
+class SavingsTaskAssignment(TaskAssignment):
+    """取り出し口の近いタスクを節約法と局所探索でバッチにまとめ、バッチごとにエージェントへ割り当てる
+
+    バッチは同じ降ろし先に向かうタスクだけでまとめ、アイテムのvolumeの合計は
+    エージェントの最大のcapacityと、全タスクをエージェントで等分した量の小さいほうまでにする。
+    バッチは長い順に、終わるのが最も早くなるエージェントへ割り当てる。capacityが足りない
+    エージェントに渡すときは、バッチを回る順のままcapacity以内の往復に分ける。
+    """
+
+    def __init__(self, world: World) -> None:
+        super().__init__(world)
+        self.world = world
+
+    def assign(self) -> None:
+        tasks = list(self.tasks)
+        end_point_ids = self.world.end_point_ids
+        pick_ids = np.array(
+            [end_point_ids[task.item.end_point.pos] for task in tasks], dtype=np.int64
+        )
+        drop_ids = np.array(
+            [end_point_ids[task.target_store_point.end_point.pos] for task in tasks], dtype=np.int64
+        )
+        # タスクが使うエンドポイントだけの距離行列 (picks, dropsはusedでの番号)
+        used, inverse = np.unique(np.concatenate([pick_ids, drop_ids]), return_inverse=True)
+        picks, drops = inverse[: len(tasks)], inverse[len(tasks) :]
+        dists = self.world.end_point_distances(used)
+        volumes = np.array([task.item.volume for task in tasks], dtype=np.int64)
+        capacities = [agent.capacity for agent in self.agents]
+        capacity = max(capacities)
+        if len(tasks) > 0:
+            # 容量が大きいと全タスクが1台に集まるので、エージェントの数で等分した量も上限にする
+            fair_share = -(-int(volumes.sum()) // len(self.agents))
+            capacity = min(capacity, max(fair_share, int(volumes.max())))
+        batches = build_batches(picks, drops, volumes, capacity, dists)
+        # 各エージェントの今の位置から各エンドポイントまでの距離と、それまでにかかる距離
+        agent_dists = [self.world.dists_from(agent.pos)[used] for agent in self.agents]
+        finish = [0] * len(self.agents)
+        lengths = [route_length(batch, picks, dists) for batch in batches]
+        for batch_id in sorted(range(len(batches)), key=lambda i: -lengths[i]):
+            batch = batches[batch_id]
+            drop = int(drops[batch[0]])
+            load = int(volumes[batch].sum())
+            max_volume = int(volumes[batch].max())
+            # (回る順, capacity) -> (往復, 往復の間の距離の合計)。capacityの種類ごとに1回だけ分ける
+            split: dict[tuple[bool, int], tuple[list[list[int]], int]] = {}
+            best: tuple[int, int, list[list[int]]] | None = None
+            for agent_id, agent_capacity in enumerate(capacities):
+                if agent_capacity < max_volume:
+                    continue
+                # 両端のどちらから回っても取り出し口を回る距離は同じ
+                for reverse, order in ((False, batch), (True, batch[::-1])):
+                    if agent_capacity >= load:
+                        trips, between = [order], lengths[batch_id]
+                    else:
+                        key = (reverse, agent_capacity)
+                        if key not in split:
+                            trips = split_route(order, volumes, agent_capacity)
+                            split[key] = (trips, trips_length(trips, picks, drop, dists))
+                        trips, between = split[key]
+                    cost = (
+                        finish[agent_id]
+                        + int(agent_dists[agent_id][picks[trips[0][0]]])
+                        + between
+                        + int(dists[picks[trips[-1][-1]], drop])
+                    )
+                    if best is None or cost < best[0]:
+                        best = (cost, agent_id, trips)
+            if best is None:
+                raise ValueError(f"item volume {max_volume} exceeds every agent's capacity")
+            cost, agent_id, trips = best
+            agent_name = self.agents[agent_id].name
+            for trip in trips:
+                for task_id in trip:
+                    self.assigned_tasks[agent_name].append(tasks[task_id])
+                    self.actions[agent_name].append(Objective.PICK_UP)
+                for task_id in trip:
+                    self.assigned_tasks[agent_name].append(tasks[task_id])
+                    self.actions[agent_name].append(Objective.DROP_OFF)
+            finish[agent_id] = cost
+            agent_dists[agent_id] = dists[drop]
+        for agent in self.agents:
+            self.actions[agent.name].append(Objective.DOCK)
+
+
+class AuctionTaskAssignment(TaskAssignment):
+    """全エージェントに1つずつのタスクを、オークション法でまとめて割り当てることを繰り返す
+
+    1回 (ウェーブ) ごとに、各エージェントの今の位置から未割り当てタスクの取り出し口までの
+    歩行距離の合計がほぼ最小になるように割り当てる。次のタスクが入らないエージェントは、
+    運んでいるアイテムを拾った順に降ろしてから次のウェーブに加わる。
+    """
+
+    def __init__(self, world: World) -> None:
+        super().__init__(world)
+        self.world = world
+
+    def assign(self) -> None:
+        tasks = list(self.tasks)
+        end_point_ids = self.world.end_point_ids
+        picks = np.array([end_point_ids[task.item.end_point.pos] for task in tasks], dtype=np.int64)
+        volumes = np.array([task.item.volume for task in tasks], dtype=np.int64)
+        capacity = np.array([agent.capacity for agent in self.agents], dtype=np.int64)
+        load = np.zeros(len(self.agents), dtype=np.int64)
+        # agent_dists[i]: エージェントiの今の位置から各エンドポイントまでの距離
+        agent_dists = np.stack([self.world.dists_from(agent.pos) for agent in self.agents])
+        carrying: list[list[Task]] = [[] for _ in self.agents]
+        remaining = np.ones(len(tasks), dtype=bool)
+        while remaining.any():
+            task_ids = np.flatnonzero(remaining)
+            fits = volumes[task_ids] <= (capacity - load)[:, np.newaxis]
+            for agent_id in np.flatnonzero(~fits.any(axis=1) & (load > 0)):
+                self._drop_off(agent_id, carrying[agent_id], agent_dists)
+                load[agent_id] = 0
+                fits[agent_id] = volumes[task_ids] <= capacity[agent_id]
+            cost = agent_dists[:, picks[task_ids]]
+            benefit = np.where(fits & (cost < UNREACHABLE_DIST), -cost.astype(np.float64), -np.inf)
+            won = auction(benefit)
+            if (won == UNASSIGNED).all():
+                raise ValueError(
+                    f"{len(task_ids)} tasks cannot be assigned (too large or unreachable)"
+                )
+            for agent_id in np.flatnonzero(won != UNASSIGNED):
+                task_id = task_ids[won[agent_id]]
+                agent_name = self.agents[agent_id].name
+                self.assigned_tasks[agent_name].append(tasks[task_id])
+                self.actions[agent_name].append(Objective.PICK_UP)
+                carrying[agent_id].append(tasks[task_id])
+                load[agent_id] += volumes[task_id]
+                agent_dists[agent_id] = self.world.dists_from(tasks[task_id].item.end_point.pos)
+                remaining[task_id] = False
+        for agent_id, agent in enumerate(self.agents):
+            self._drop_off(agent_id, carrying[agent_id], agent_dists)
+            self.actions[agent.name].append(Objective.DOCK)
+
+    def _drop_off(self, agent_id: int, carrying: list[Task], agent_dists: np.ndarray) -> None:
+        """carryingのアイテムを拾った順に降ろす (carryingは空になる)"""
+        agent_name = self.agents[agent_id].name
+        for task in carrying:
+            self.assigned_tasks[agent_name].append(task)
+            self.actions[agent_name].append(Objective.DROP_OFF)
+        if carrying:
+            pos = carrying[-1].target_store_point.end_point.pos
+            agent_dists[agent_id] = self.world.dists_from(pos)
+        carrying.clear()
 
 
 class ManuallyTaskAssignment(TaskAssignment):
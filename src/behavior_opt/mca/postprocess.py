@@ -11,6 +11,7 @@ from numpy.typing import NDArray
 
 from behavior_opt.sh_core import AgentConfig, Position, Objective
 from behavior_opt.utils.file_io import read_agent_config
+from behavior_opt.utils.validation import find_conflicts, read_trajectory, summarize
 
 
 @dataclass
@@ -229,3 +230,5 @@ if __name__ == "__main__":
         task_file_path, agent_configs_path, mca_file_path, output_dir_path
     )
     print(max(map(lambda x: len(x), path_output)))
+    _, trajectory = read_trajectory(output_dir_path / "output.csv")
+    print("conflicts:", summarize(find_conflicts(trajectory)))
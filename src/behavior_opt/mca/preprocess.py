@@ -6,6 +6,7 @@ import numpy as np
 from behavior_opt.sh_core import Tasks, World
 from behavior_opt.utils.file_io import (
     read_agent_config,
+    read_compiled_map,
     read_item_config,
     read_map_config,
     read_picking_list,
@@ -115,6 +116,7 @@ def preprocess(
         picking_list=picking_list,
         agent_configs=agent_config,
         item_configs=item_config,
+        compiled_map=read_compiled_map(map_config_path),
     )
     output_dir.mkdir(exist_ok=True, parents=True)
     output_dir.mkdir(exist_ok=True, parents=True)
@@ -1,4 +1,7 @@
 from behavior_opt.sh_core.agent import *
+from behavior_opt.sh_core.collection import *
+from behavior_opt.sh_core.compiled_map import *
+from behavior_opt.sh_core.distance import *
 from behavior_opt.sh_core.end_point import *
 from behavior_opt.sh_core.item import *
 from behavior_opt.sh_core.rack import *
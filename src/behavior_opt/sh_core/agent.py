@@ -1,12 +1,15 @@
 from copy import copy
-from typing import Iterator, Literal
+from typing import Literal
 
+from behavior_opt.sh_core.collection import IndexedList
 from behavior_opt.sh_core.item import Item, Items
 from behavior_opt.sh_core.task import Tasks
 from behavior_opt.sh_core.typing import Name, Position
 
 
 class Goal:
+    __slots__ = ("pos", "name", "pick_direction")
+
     def __init__(self, pos: Position, name: Name = "") -> None:
         self.pos = pos
         self.name = name
@@ -14,6 +17,22 @@ class Goal:
 
 
 class Agent:
+    # output_list, directionはstorehouseのシミュレーションで設定する
+    __slots__ = (
+        "pos",
+        "initial_pos",
+        "name",
+        "goal",
+        "volume",
+        "capacity",
+        "having_items",
+        "task_results",
+        "tasks",
+        "target",
+        "output_list",
+        "direction",
+    )
+
     def __init__(
         self,
         pos: Position,
@@ -49,45 +68,34 @@ class Agent:
         return abs(self.pos[0] - pos[0]) + abs(self.pos[1] - pos[1])
 
 
-class Agents:
+class Agents(IndexedList[Agent]):
     def __init__(self, agents: list[Agent]) -> None:
-        self._object_list = agents
-        self._names = [agent.name for agent in agents]
-        self._positions = [agent.pos for agent in agents]
+        super().__init__(agents)
+
+    def _name_of(self, agent: Agent) -> Name:
+        return agent.name
 
     def index(self, name: Name) -> int:
-        return self._names.index(name)
+        return self._index(self._first_slot(name))
 
     @property
     def names(self) -> list[str]:
-        return self._names[:]
+        return [agent.name for agent in self]
 
     @property
     def positions(self) -> list[Position]:
-        self._positions = [agent.pos for agent in self._object_list]
-        return self._positions[:]
-
-    def __iter__(self) -> Iterator[Agent]:
-        return iter(self._object_list)
-
-    def __len__(self) -> int:
-        return len(self._object_list)
+        return [agent.pos for agent in self]
 
     def __getitem__(self, key: Name | int) -> Agent:
         if isinstance(key, Name):
-            return self._object_list[self.index(key)]
-        return self._object_list[key]
+            return self._slots[self._first_slot(key)]  # type: ignore
+        return self._at(key)
 
     def append(self, agent: Agent) -> None:
-        self._object_list.append(agent)
-        self._names.append(agent.name)
-        self._positions.append(agent.pos)
+        self._append(agent)
 
     def remove(self, agent: Agent) -> None:
-        index = self.index(agent.name)
-        del self._object_list[index]
-        del self._names[index]
-        del self._positions[index]
+        self._remove_slot(self._first_slot(agent.name))
 
     def reset(self) -> None:
         for a in self:
@@ -98,4 +106,3 @@ class Agents:
             a.task_results  = None
             a.tasks = Tasks([])
             a.target = None
-        self._positions = [a.pos for a in self._object_list]
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right, insort
+from typing import Generic, Hashable, Iterator, TypeVar
+
+T = TypeVar("T")
+# キーから場所への辞書の値。ほとんどのキーは1つしかないので、重なったときだけリストにする
+_Slots = int | list[int]
+
+
+def _index_add(index: dict[Hashable, _Slots], key: Hashable, slot: int) -> None:
+    slots = index.get(key)
+    if slots is None:
+        index[key] = slot
+    elif isinstance(slots, int):
+        index[key] = [slots, slot]
+    else:
+        slots.append(slot)
+
+
+def _index_remove(index: dict[Hashable, _Slots], key: Hashable, slot: int) -> None:
+    slots = index[key]
+    if isinstance(slots, int):
+        del index[key]
+        return
+    slots.remove(slot)
+    if len(slots) == 1:
+        index[key] = slots[0]
+
+
+def _index_first(slots: _Slots) -> int:
+    return slots if isinstance(slots, int) else slots[0]
+
+
+def _index_build(keys: list[Hashable], start: int = 0) -> dict[Hashable, _Slots]:
+    """keys[i]の場所をstart + iとした辞書 (_index_addを順に呼ぶのと同じ結果)"""
+    index: dict[Hashable, _Slots] = dict(zip(keys, range(start, start + len(keys))))
+    if len(index) == len(keys):
+        return index
+    # キーが重なっていれば、zipでは後の場所が残るので作り直す
+    groups: dict[Hashable, list[int]] = {}
+    for slot, key in enumerate(keys, start):
+        groups.setdefault(key, []).append(slot)
+    return {key: slots[0] if len(slots) == 1 else slots for key, slots in groups.items()}
+
+
+def _index_merge(index: dict[Hashable, _Slots], other: dict[Hashable, _Slots]) -> None:
+    """otherの場所 (indexのどの場所より後ろ) をindexに足す"""
+    if index.keys().isdisjoint(other):
+        index.update(other)
+        return
+    for key, slots in other.items():
+        for slot in [slots] if isinstance(slots, int) else slots:
+            _index_add(index, key, slot)
+
+
+class IndexedList(Generic[T]):
+    """名前や位置から要素の場所を辞書で引くリスト (sh_coreのコレクションの基底クラス)
+
+    要素を消すときは場所を空き (None) にして辞書から外すだけなので、名前や位置で引くのはO(1)。
+    番号で要素を指すときは、途中の空きの場所 (昇順) を二分探索してO(log n)で場所に直す。
+    空きが全体の半分を超えたらまとめて詰める (回している途中は詰めない)。
+    同じ名前の要素が複数あるときは、list.indexと同じく前にあるものを返す。
+    並び順は追加した順 (または並べ直した順) のまま。
+    """
+
+    def __init__(self, objects: list[T]) -> None:
+        # 回している途中のイテレータの数
+        self._n_iterators = 0
+        self._rebuild(objects)
+
+    def _name_of(self, obj: T) -> Hashable:
+        raise NotImplementedError
+
+    def _pos_of(self, obj: T) -> Hashable | None:
+        """位置で引かないコレクションはNone"""
+        return None
+
+    def _rebuild(self, objects: list[T]) -> None:
+        """objectsの順に並べ、辞書を作り直す (名前を付け直したときにも呼ぶ)"""
+        self._slots: list[T | None] = list(objects)
+        # 先頭の空きの数と、それより後ろの空きの数
+        self._head = 0
+        self._holes = 0
+        # 先頭以外で空きにした場所 (昇順、self._headより前のものも含む)
+        self._hole_slots: list[int] = []
+        # 1要素ずつ_add_keysするより、キーを並べてから辞書をまとめて作るほうが速い
+        self._by_name: dict[Hashable, _Slots] = _index_build(
+            [self._name_of(obj) for obj in self._slots]  # type: ignore
+        )
+        self._by_pos: dict[Hashable, _Slots] = {}
+        if self._has_pos():
+            self._by_pos = _index_build([self._pos_of(obj) for obj in self._slots])  # type: ignore
+
+    def _has_pos(self) -> bool:
+        """_pos_ofを上書きして位置で引くコレクションか (位置で引くなら位置はNoneにしない)"""
+        return type(self)._pos_of is not IndexedList._pos_of
+
+    def _add_keys(self, obj: T, slot: int) -> None:
+        _index_add(self._by_name, self._name_of(obj), slot)
+        pos = self._pos_of(obj)
+        if pos is not None:
+            _index_add(self._by_pos, pos, slot)
+
+    def _first_slot(self, name: Hashable) -> int:
+        slots = self._by_name.get(name)
+        if slots is None:
+            raise ValueError(f"{name!r} is not in list")
+        return _index_first(slots)
+
+    def _first_slot_at(self, pos: Hashable) -> int:
+        slots = self._by_pos.get(pos)
+        if slots is None:
+            raise ValueError(f"{pos!r} is not in list")
+        return _index_first(slots)
+
+    def _find_at(self, pos: Hashable) -> T | None:
+        slots = self._by_pos.get(pos)
+        if slots is None:
+            return None
+        return self._slots[_index_first(slots)]
+
+    def _slots_of(self, name: Hashable) -> list[int]:
+        slots = self._by_name.get(name, [])
+        return [slots] if isinstance(slots, int) else slots
+
+    def _compact(self) -> None:
+        self._rebuild([obj for obj in self._slots if obj is not None])
+
+    def _slot(self, index: int) -> int:
+        """前から何番目かを場所に直す"""
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("list index out of range")
+        if self._holes == 0:
+            return self._head + index
+        holes = self._hole_slots
+        start = bisect_left(holes, self._head)
+        # start + j番目の空きより前にある要素の数はholes[start + j] - j - self._headで、jについて単調
+        # なので、index番目の要素より前にある空きの数を二分探索で数える
+        n_holes = bisect_right(
+            range(start, len(holes)), self._head + index, key=lambda j: holes[j] - (j - start)
+        )
+        return self._head + index + n_holes
+
+    def _at(self, index: int) -> T:
+        """前から何番目かの要素"""
+        slot = self._slot(index)
+        return self._slots[slot]  # type: ignore
+
+    def _index(self, slot: int) -> int:
+        """場所を前から何番目かに直す"""
+        if self._holes == 0:
+            return slot - self._head
+        holes = self._hole_slots
+        return slot - self._head - (bisect_left(holes, slot) - bisect_left(holes, self._head))
+
+    def _append(self, obj: T) -> None:
+        self._slots.append(obj)
+        self._add_keys(obj, len(self._slots) - 1)
+
+    def _extend(self, objects: list[T]) -> None:
+        """objectsを順に末尾に足す (_appendを順に呼ぶのと同じ結果で、辞書はまとめて作る)"""
+        start = len(self._slots)
+        self._slots.extend(objects)
+        added: list[T] = self._slots[start:]  # type: ignore
+        names = [self._name_of(obj) for obj in added]
+        _index_merge(self._by_name, _index_build(names, start))
+        if self._has_pos():
+            positions = [self._pos_of(obj) for obj in added]
+            _index_merge(self._by_pos, _index_build(positions, start))
+
+    def _remove_slot(self, slot: int) -> T:
+        obj = self._slots[slot]
+        assert obj is not None, "slot is already removed"
+        self._slots[slot] = None
+        _index_remove(self._by_name, self._name_of(obj), slot)
+        pos = self._pos_of(obj)
+        if pos is not None:
+            _index_remove(self._by_pos, pos, slot)
+        if slot == self._head:
+            self._head += 1
+            while self._head < len(self._slots) and self._slots[self._head] is None:
+                self._head += 1
+                self._holes -= 1
+        else:
+            self._holes += 1
+            insort(self._hole_slots, slot)
+        while len(self._slots) > self._head and self._slots[-1] is None:
+            # 末尾の空きは最後の空きの場所
+            self._slots.pop()
+            self._hole_slots.pop()
+            self._holes -= 1
+        # 詰めるのは空きが半分を超えてからなので、詰める手間は消した数で割ればO(1)
+        if self._n_iterators == 0 and (
+            self._head == len(self._slots)
+            or self._head + self._holes > max(len(self._slots) // 2, 64)
+        ):
+            self._compact()
+        return obj
+
+    def __iter__(self) -> Iterator[T]:
+        # 途中で消された要素は飛ばし、追加された要素は含める
+        # (listと違い、回している要素を消しても次の要素は飛ばさない)
+        self._n_iterators += 1
+        try:
+            for obj in self._slots:
+                if obj is not None:
+                    yield obj
+        finally:
+            self._n_iterators -= 1
+
+    def __len__(self) -> int:
+        return len(self._slots) - self._head - self._holes
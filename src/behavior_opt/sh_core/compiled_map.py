@@ -0,0 +1,136 @@
+import zipfile
+from pathlib import Path
+
+import numpy as np
+from numpy.typing import NDArray
+
+from behavior_opt.sh_core.distance import distance_matrix, distances_to, neighbor_table
+from behavior_opt.sh_core.end_point import select_end_point_position
+from behavior_opt.sh_core.typing import MapConfig, Position
+
+# config.jsonと同じディレクトリに置くファイル名
+COMPILED_MAP_FILENAME = "compiled_map.npz"
+_FIELDS = ("passable", "neighbors", "end_point_positions", "end_point_dists")
+
+
+class CompiledMap:
+    """マップだけから決まる配列をまとめたもの
+
+    アップロード時にcompileしてsaveし、計画のたびにloadして使い回す (World._reset_distancesで使う)。
+    - passable: 通れるマス (棚以外)
+    - neighbors: (マス数, 4)の隣接表 (distance.neighbor_table)
+    - end_point_positions: 棚のマスからアイテムを取り出すときに立つ位置 (行優先の順)
+    - end_point_dists: end_point_positionsの各組の歩行距離
+    """
+
+    def __init__(
+        self,
+        passable: NDArray[np.bool_],
+        neighbors: NDArray[np.int32],
+        end_point_positions: NDArray[np.int32],
+        end_point_dists: NDArray[np.uint16],
+    ) -> None:
+        self.passable = passable
+        self.neighbors = neighbors
+        self.end_point_positions = end_point_positions
+        self.end_point_dists = end_point_dists
+        self.end_point_ids: dict[Position, int] = {
+            Position(*pos): i for i, pos in enumerate(end_point_positions.tolist())
+        }
+
+    def __deepcopy__(self, memo: dict) -> "CompiledMap":
+        # 読み取り専用なので、Worldをコピーしてもメモリマップを共有する
+        return self
+
+    @classmethod
+    def compile(cls, map_config: MapConfig) -> "CompiledMap":
+        height, width = map_config["map_height"], map_config["map_width"]
+        racks = map_config["racks"]
+        rack_labels = np.full((height, width), -1, dtype=np.int32)
+        # 棚が重なるマスはWorld._find_rackと同じく先の棚のものにする
+        for i in reversed(range(len(racks))):
+            row, col = racks[i]["pos"]
+            rack_labels[row : row + racks[i]["height"], col : col + racks[i]["width"]] = i
+        passable = rack_labels < 0
+
+        def can_put(pos: Position) -> bool:
+            return 0 <= pos.row < height and 0 <= pos.col < width and passable[pos.row, pos.col]
+
+        end_points: set[Position] = set()
+        for rack_id, rack in enumerate(racks):
+            pick_direction = rack.get("pick_direction", "horizontal")
+            row, col = rack["pos"]
+            area = rack_labels[row : row + rack["height"], col : col + rack["width"]]
+            for d_row, d_col in zip(*np.nonzero(area == rack_id)):
+                pos = select_end_point_position(
+                    Position(row + int(d_row), col + int(d_col)), can_put, pick_direction
+                )
+                # 両側とも棚や壁で取り出せないマスは除く
+                if can_put(pos):
+                    end_points.add(pos)
+        positions = sorted(end_points, key=lambda pos: pos.row * width + pos.col)
+        return cls(
+            passable=passable,
+            neighbors=neighbor_table(passable),
+            end_point_positions=np.array(positions, dtype=np.int32).reshape(-1, 2),
+            end_point_dists=distance_matrix(passable, positions),
+        )
+
+    def save(self, path: Path) -> None:
+        # 無圧縮で保存すると、loadでzipの中の配列をそのままメモリマップできる
+        np.savez(path, **{name: getattr(self, name) for name in _FIELDS})
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "CompiledMap":
+        """pathのnpzを読む (mmapならend_point_distsなどを読み込まずにメモリマップする)"""
+        if not mmap:
+            with np.load(path) as npz:
+                return cls(**{name: npz[name] for name in _FIELDS})
+        arrays: dict[str, NDArray] = {}
+        with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+            for name in _FIELDS:
+                info = archive.getinfo(name + ".npy")
+                assert info.compress_type == zipfile.ZIP_STORED, "npz must be uncompressed"
+                # ローカルヘッダ (30バイト + ファイル名 + 拡張フィールド) の後ろに.npyが続く
+                f.seek(info.header_offset + 26)
+                name_len, extra_len = np.frombuffer(f.read(4), dtype="<u2")
+                f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                if np.prod(shape) == 0:
+                    arrays[name] = np.zeros(shape, dtype=dtype)
+                    continue
+                arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode="r",
+                    offset=f.tell(),
+                    shape=shape,
+                    order="F" if fortran_order else "C",
+                )
+        return cls(**arrays)
+
+    def matches(self, passable: NDArray[np.bool_]) -> bool:
+        """passableが同じマップから作られたか (config.jsonを書き換えた後の古いnpzを弾く)"""
+        return self.passable.shape == passable.shape and np.array_equal(
+            self.passable, passable
+        )
+
+    def distances(self, positions: list[Position]) -> NDArray[np.uint16]:
+        """positionsの各組の歩行距離 (distance_matrixと同じ形式)
+
+        棚の取り出し口でない位置 (棚以外に置かれたアイテムなど) だけはその位置からBFSする。
+        """
+        ids = np.array([self.end_point_ids.get(pos, -1) for pos in positions], dtype=int)
+        known = ids >= 0
+        dists = np.empty((len(positions), len(positions)), dtype=np.uint16)
+        dists[np.ix_(known, known)] = self.end_point_dists[np.ix_(ids[known], ids[known])]
+        for i in np.flatnonzero(~known):
+            # 4近傍の距離は対称なので、行と列の両方を埋める
+            dists[i] = dists[:, i] = distances_to(
+                self.passable, positions[i], positions, self.neighbors
+            )
+        return dists
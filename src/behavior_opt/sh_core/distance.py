@@ -0,0 +1,121 @@
+import numpy as np
+from numpy.typing import NDArray
+
+from behavior_opt.sh_core.typing import Position
+
+# 距離行列で到達できないことを表す値
+UNREACHABLE_DIST = np.iinfo(np.uint16).max
+# grid_distancesで到達できないことを表す値
+UNREACHABLE = np.iinfo(np.int32).max
+# 隣接表で隣がないことを表す値
+NIL = -1
+# networkx.grid_2d_graphと同じ隣接順 (上, 下, 左, 右)
+NEIGHBOR_OFFSETS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int32)
+
+
+def neighbor_table(passable: NDArray[np.bool_]) -> NDArray[np.int32]:
+    """(n_cells, 4)の隣接表 (通れない隣と、通れないマスの行はNIL)"""
+    height, width = passable.shape
+    rows, cols = np.indices(passable.shape)
+    nbr_rows = rows.reshape(-1, 1) + NEIGHBOR_OFFSETS[:, 0]
+    nbr_cols = cols.reshape(-1, 1) + NEIGHBOR_OFFSETS[:, 1]
+    valid = (0 <= nbr_rows) & (nbr_rows < height) & (0 <= nbr_cols) & (nbr_cols < width)
+    nbr_ids = np.where(valid, nbr_rows * width + nbr_cols, 0)
+    valid &= passable.reshape(-1, 1) & passable.ravel()[nbr_ids]
+    return np.where(valid, nbr_ids, NIL).astype(np.int32)
+
+
+def grid_distances(
+    passable: NDArray[np.bool_],
+    source: Position,
+    neighbors: NDArray[np.integer] | None = None,
+    target: Position | None = None,
+) -> NDArray[np.int32]:
+    """sourceから各マスまでの4近傍での最短経路長 (グリッド形状、到達できなければUNREACHABLE)
+
+    neighborsはpassableの隣接表 (コンパイル済みのマップやGridGraphにあれば使い回す)。
+    targetを指定した場合はtargetに到達した時点で打ち切る (それより遠いマスはUNREACHABLE)。
+    """
+    height, width = passable.shape
+    if neighbors is None:
+        neighbors = neighbor_table(passable)
+    dist = np.full(height * width + 1, UNREACHABLE, dtype=np.int32)
+    # 末尾は隣がないことを表す番兵 (NILは-1なので末尾を指す)
+    dist[-1] = 0
+    frontier = np.array([source[0] * width + source[1]])
+    dist[frontier] = 0
+    target_id = -1 if target is None else target[0] * width + target[1]
+    d = 0
+    while len(frontier) > 0 and (target is None or dist[target_id] == UNREACHABLE):
+        d += 1
+        candidates = neighbors[frontier].ravel()
+        frontier = np.unique(candidates[dist[candidates] == UNREACHABLE])
+        dist[frontier] = d
+    return dist[:-1].reshape(passable.shape)
+
+
+def distances_to(
+    passable: NDArray[np.bool_],
+    source: Position,
+    positions: list[Position],
+    neighbors: NDArray[np.integer] | None = None,
+) -> NDArray[np.uint16]:
+    """sourceからpositionsの各位置までの歩行距離 (到達できなければUNREACHABLE_DIST)"""
+    grid = grid_distances(passable, source, neighbors)
+    rows, cols = np.array(positions, dtype=int).reshape(-1, 2).T
+    dists = grid[rows, cols]
+    return np.where(dists == UNREACHABLE, UNREACHABLE_DIST, dists).astype(np.uint16)
+
+
+def distance_matrix(passable: NDArray[np.bool_], positions: list[Position]) -> NDArray[np.uint16]:
+    """positionsの各組の4近傍での最短経路長 ((n, n)のuint16、到達できなければUNREACHABLE_DIST)"""
+    return distances_between(passable, positions, positions)
+
+
+def distances_between(
+    passable: NDArray[np.bool_], sources: list[Position], positions: list[Position]
+) -> NDArray[np.uint16]:
+    """sourcesの各位置からpositionsの各位置までの4近傍での最短経路長
+    ((len(sources), len(positions))のuint16、到達できなければUNREACHABLE_DIST)
+
+    全sourceを始点とするBFSを、マスごとに「到達した始点」のビットを詰めた配列で同時に進める。
+    1ステップは上下左右にずらした配列とのビットORなので、BFSを始点の数だけ繰り返すより速い。
+    経路長はUNREACHABLE_DISTより短いものとする。
+    """
+    n = len(sources)
+    if n == 0 or len(positions) == 0:
+        return np.zeros((n, len(positions)), dtype=np.uint16)
+    source_rows = np.array([pos[0] for pos in sources], dtype=np.int64)
+    source_cols = np.array([pos[1] for pos in sources], dtype=np.int64)
+    assert passable[source_rows, source_cols].all(), "sources must be passable"
+    rows = np.array([pos[0] for pos in positions], dtype=np.int64)
+    cols = np.array([pos[1] for pos in positions], dtype=np.int64)
+    source_ids = np.arange(n)
+    # reached[row, col]: そのマスに到達した始点のビット列
+    reached = np.zeros((*passable.shape, (n + 7) // 8), dtype=np.uint8)
+    np.bitwise_or.at(
+        reached,
+        (source_rows, source_cols, source_ids // 8),
+        (0x80 >> (source_ids % 8)).astype(np.uint8),
+    )
+    mask = np.where(passable, 0xFF, 0).astype(np.uint8)[:, :, np.newaxis]
+    # 最後の軸に沿って放送するより、同じ形にしておいたほうがANDが速い
+    mask = np.repeat(mask, reached.shape[2], axis=2)
+    # 距離は「まだ到達していないステップ」の数として数える ([終点, 始点])
+    counts = np.zeros((len(positions), n), dtype=np.uint16)
+    while True:
+        unreached = np.unpackbits(reached[rows, cols], axis=1)[:, :n] == 0
+        if not unreached.any():
+            break
+        counts += unreached
+        grown = reached.copy()
+        grown[1:] |= reached[:-1]
+        grown[:-1] |= reached[1:]
+        grown[:, 1:] |= reached[:, :-1]
+        grown[:, :-1] |= reached[:, 1:]
+        grown &= mask
+        if np.array_equal(grown, reached):
+            counts[unreached] = UNREACHABLE_DIST
+            break
+        reached = grown
+    return counts.T.copy()
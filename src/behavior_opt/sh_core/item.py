@@ -1,17 +1,20 @@
 from __future__ import annotations
 
 from copy import copy
-from typing import TYPE_CHECKING, Iterator
+from typing import TYPE_CHECKING, Callable
 
 if TYPE_CHECKING:
     from behavior_opt.sh_core.agent import Agent
     from behavior_opt.sh_core.end_point import EndPoint
     from behavior_opt.sh_core.store_point import StorePoint
 
+from behavior_opt.sh_core.collection import IndexedList
 from behavior_opt.sh_core.typing import Length, Name, Position
 
 
 class Item:
+    __slots__ = ("name", "volume", "pos", "current_owner", "end_point", "is_picked", "ship_target")
+
     def __init__(
         self,
         name: Name,
@@ -41,6 +44,8 @@ class Item:
 
 
 class ItemSet:
+    __slots__ = ("item", "amount", "dist")
+
     def __init__(self, item: Item, amount: int) -> None:
         self.item = item
         self.amount = amount
@@ -53,91 +58,90 @@ class ItemSet:
             return copy(self.item)
         return None
 
-    def calculate_dist(self) -> None:
+    def calculate_dist(self, get_dist: Callable[[Position, Position], int] | None = None) -> None:
+        """出荷先までの距離 (get_distを渡した場合はエンドポイント間のget_dist)"""
         ship_target = self.item.ship_target
-        if ship_target is not None:
+        if ship_target is None:
+            return
+        if get_dist is None:
             self.dist = self.item.get_dist(ship_target.pos)
+        else:
+            assert self.item.end_point is not None, "item's end_point is None"
+            assert ship_target.end_point is not None, "ship_target's end_point is None"
+            self.dist = get_dist(self.item.end_point.pos, ship_target.end_point.pos)
 
 
-class Items:
+class Items(IndexedList[ItemSet]):
     def __init__(self, item_set_list: list[ItemSet]) -> None:
-        self._object_list = item_set_list
-        self._names = [item_set.item.name for item_set in self._object_list]
-        self._positions = [item_set.item.pos for item_set in self._object_list]
+        super().__init__(item_set_list)
+
+    def _name_of(self, item_set: ItemSet) -> Name:
+        return item_set.item.name
 
     def index(self, name: Name) -> int:
-        return self._names.index(name)
+        return self._index(self._first_slot(name))
 
     @property
     def names(self) -> list[str]:
-        return self._names[:]
+        return [item_set.item.name for item_set in self]
 
     @property
     def positions(self) -> list[Position]:
-        return self._positions[:]
-
-    def __iter__(self) -> Iterator[ItemSet]:
-        return iter(self._object_list)
-
-    def __len__(self) -> int:
-        return len(self._object_list)
+        return [item_set.item.pos for item_set in self]
 
     def __getitem__(self, key: Name | int) -> ItemSet:
         if isinstance(key, int):
-            return self._object_list[key]
-        return self._object_list[self.index(key)]
+            return self._at(key)
+        return self._slots[self._first_slot(key)]  # type: ignore
 
     def pop(self, key: Name | int) -> Item | None:
         if len(self) == 0:
             return None
-        if isinstance(key, int):
-            item_set = self._object_list[key]
-        else:
-            item_set = self._object_list[self.index(key)]
+        item_set = self[key]
         item = item_set.pop()
         if item_set.amount == 0:
             self.remove(item_set)
         return item
 
     def add(self, item: Item) -> None:
-        if item.name in self._names:
-            self._object_list[self.index(item.name)].amount += 1
+        if item.name in self._by_name:
+            self._slots[self._first_slot(item.name)].amount += 1  # type: ignore
         else:
             self.append(ItemSet(item, 1))
 
     def append(self, item_set: ItemSet) -> None:
-        self._object_list.append(item_set)
-        self._names.append(item_set.item.name)
-        self._positions.append(item_set.item.pos)
+        self._append(item_set)
 
-    def remove(self, item_set: ItemSet) -> None:
-        index = self._object_list.index(item_set)
-        del self._object_list[index]
-        del self._names[index]
-        del self._positions[index]
-
-    def calculate_dists(self) -> None:
-        for item_set in self._object_list:
-            item_set.calculate_dist()
+    def extend(self, item_sets: list[ItemSet]) -> None:
+        self._extend(item_sets)
 
-    def sort(self) -> None:
-        self.calculate_dists()
+    def remove(self, item_set: ItemSet) -> None:
+        for slot in self._slots_of(item_set.item.name):
+            if self._slots[slot] is item_set:
+                self._remove_slot(slot)
+                return
+        raise ValueError(f"{item_set!r} is not in list")
+
+    def calculate_dists(self, get_dist: Callable[[Position, Position], int] | None = None) -> None:
+        for item_set in self:
+            item_set.calculate_dist(get_dist)
+
+    def sort(self, get_dist: Callable[[Position, Position], int] | None = None) -> None:
+        """出荷先までの距離の順に並べる (距離はItemSet.calculate_dist)"""
+        self.calculate_dists(get_dist)
         dists = [item_set.dist for item_set in self if item_set.dist is not None]
         if len(dists) == 0:
             return
         max_dist = max(dists)
-        self._object_list.sort(
-            key=lambda item_set: item_set.dist
-            if item_set.dist is not None
-            else max_dist + 1
+        self._rebuild(
+            sorted(
+                self,
+                key=lambda item_set: item_set.dist
+                if item_set.dist is not None
+                else max_dist + 1,
+            )
         )
-        self._names = [item_set.item.name for item_set in self._object_list]
-        self._positions = [item_set.item.pos for item_set in self._object_list]
 
     def reset(self) -> None:
-        self._object_list = [
-            ItemSet(item_set.item, item_set.amount) for item_set in self._object_list
-        ]
-        self._names = [item_set.item.name for item_set in self._object_list]
-        self._positions = [item_set.item.pos for item_set in self._object_list]
+        self._rebuild([ItemSet(item_set.item, item_set.amount) for item_set in self])
         self.sort()
@@ -1,9 +1,10 @@
-from typing import Iterator
-
+from behavior_opt.sh_core.collection import IndexedList
 from behavior_opt.sh_core.typing import Length, Name, PickDirection, Position
 
 
 class Rack:
+    __slots__ = ("name", "pos", "width", "height", "pick_direction")
+
     def __init__(
         self,
         pos: Position,
@@ -19,45 +20,39 @@ class Rack:
         self.pick_direction: PickDirection = pick_direction
 
 
-class Racks:
+class Racks(IndexedList[Rack]):
     def __init__(self, racks: list[Rack]) -> None:
-        self._object_list = racks
-        self._names = [rack.name for rack in racks]
-        self._positions = [rack.pos for rack in racks]
+        super().__init__(racks)
+
+    def _name_of(self, rack: Rack) -> Name:
+        return rack.name
+
+    def _pos_of(self, rack: Rack) -> Position:
+        return rack.pos
 
     def index(self, name: Name) -> int:
-        return self._names.index(name)
+        return self._index(self._first_slot(name))
 
     @property
     def names(self) -> list[str]:
-        return self._names[:]
+        return [rack.name for rack in self]
 
     @property
     def positions(self) -> list[Position]:
-        return self._positions[:]
-
-    def __iter__(self) -> Iterator[Rack]:
-        return iter(self._object_list)
-
-    def __len__(self) -> int:
-        return len(self._object_list)
+        return [rack.pos for rack in self]
 
     def __getitem__(self, key: Name | int) -> Rack:
         if isinstance(key, Name):
-            return self._object_list[self.index(key)]
-        return self._object_list[key]
+            return self._slots[self._first_slot(key)]  # type: ignore
+        return self._at(key)
 
     def append(self, item: Rack) -> None:
-        self._object_list.append(item)
-        self._names.append(item.name)
-        self._positions.append(item.pos)
+        self._append(item)
 
     def remove(self, item: Rack) -> None:
-        index = self.index(item.name)
-        del self._object_list[index]
-        del self._names[index]
-        del self._positions[index]
+        self._remove_slot(self._first_slot(item.name))
 
     def reset(self) -> None:
         for i, rack in enumerate(self):
             rack.name = "rack_{}".format(i)
+        self._rebuild(list(self))
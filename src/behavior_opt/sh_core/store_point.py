@@ -1,11 +1,12 @@
-from typing import Iterator
-
+from behavior_opt.sh_core.collection import IndexedList
 from behavior_opt.sh_core.end_point import EndPoint
 from behavior_opt.sh_core.item import Item, Items
 from behavior_opt.sh_core.typing import Name, PickDirection, Position
 
 
 class StorePoint:
+    __slots__ = ("pos", "name", "pick_direction", "end_point", "having_items", "is_picked")
+
     def __init__(
         self,
         pos: Position,
@@ -30,59 +31,52 @@ class StorePoint:
         return taken_out_item
 
 
-class StorePoints:
+class StorePoints(IndexedList[StorePoint]):
     def __init__(self, store_points: list[StorePoint]) -> None:
-        self._object_list = store_points
-        self._names = [store_point.name for store_point in store_points]
-        self._positions = [store_point.pos for store_point in store_points]
-        self._pick_directions: list[PickDirection] = [
-            store_point.pick_direction for store_point in store_points
-        ]
+        super().__init__(store_points)
+
+    def _name_of(self, store_point: StorePoint) -> Name:
+        return store_point.name
+
+    def _pos_of(self, store_point: StorePoint) -> Position:
+        return store_point.pos
 
     def index(self, name: Name) -> int:
-        return self._names.index(name)
+        return self._index(self._first_slot(name))
 
     @property
     def names(self) -> list[Name]:
-        return self._names[:]
+        return [store_point.name for store_point in self]
 
     @property
     def positions(self) -> list[Position]:
-        return self._positions[:]
+        return [store_point.pos for store_point in self]
 
     @property
     def pick_directions(self) -> list[PickDirection]:
-        return self._pick_directions[:]
-
-    def __iter__(self) -> Iterator[StorePoint]:
-        return iter(self._object_list)
-
-    def __len__(self) -> int:
-        return len(self._object_list)
+        return [store_point.pick_direction for store_point in self]
 
     def __getitem__(self, key: Name | int | Position) -> StorePoint:
         if isinstance(key, Name):
-            return self._object_list[self.index(key)]
+            return self._slots[self._first_slot(key)]  # type: ignore
         if isinstance(key, Position):
-            return self._object_list[self._positions.index(key)]
-        return self._object_list[key]
+            return self._slots[self._first_slot_at(key)]  # type: ignore
+        return self._at(key)
+
+    def get(self, pos: Position) -> StorePoint | None:
+        """posにあるストアポイント (なければNone)"""
+        return self._find_at(pos)
 
     def append(self, store_point: StorePoint) -> None:
-        self._object_list.append(store_point)
-        self._names.append(store_point.name)
-        self._positions.append(store_point.pos)
-        self._pick_directions.append(store_point.pick_direction)
+        self._append(store_point)
+
+    def extend(self, store_points: list[StorePoint]) -> None:
+        self._extend(store_points)
 
     def remove(self, store_point: StorePoint) -> None:
-        index = self.index(store_point.name)
-        del self._object_list[index]
-        del self._names[index]
-        del self._positions[index]
-        del self._pick_directions[index]
+        self._remove_slot(self._first_slot(store_point.name))
 
     def reset(self) -> None:
         for i, sp in enumerate(self):
             sp.name = "store_point_{}".format(i)
-        self._names = [sp.name for sp in self]
-        self._pick_directions = [sp.pick_direction for sp in self]
-        self._positions = [sp.pos for sp in self]
+        self._rebuild(list(self))
@@ -1,51 +1,50 @@
-from typing import Iterator, NamedTuple
+from typing import NamedTuple
 
+from behavior_opt.sh_core.collection import IndexedList
 from behavior_opt.sh_core.item import Item
 from behavior_opt.sh_core.store_point import StorePoint
 from behavior_opt.sh_core.typing import Name
 
 # そのアイテムと運ぶポイントを保持するクラス
 # エージェントに割り振られていないタスクを保持する
+# itemは在庫のItemそのもの (コピーしない) で、unitはそのItemSetの何個目か
 class Task(NamedTuple):
     item: Item
     target_store_point: StorePoint
+    unit: int = 0
 
 
-class Tasks:
+class Tasks(IndexedList[Task]):
     def __init__(self, task_list: list[Task]) -> None:
-        self._tasks: list[Task] = task_list
-        self._item_ids: list[Name] = [task.item.name for task in task_list]
+        super().__init__(task_list)
+
+    def _name_of(self, task: Task) -> Name:
+        return task.item.name
 
     def index(self, item_id: Name) -> int:
-        return self._item_ids.index(item_id)
+        return self._index(self._first_slot(item_id))
 
     @property
     def items(self) -> list[Name]:
-        return self._item_ids[:]
-
-    def __len__(self) -> int:
-        return len(self._tasks)
+        return [task.item.name for task in self]
 
     def __getitem__(self, key: Name | Item | int) -> Task:
         if isinstance(key, Name):
-            return self._tasks[self.index(key)]
+            return self._slots[self._first_slot(key)]  # type: ignore
         if isinstance(key, Item):
-            return self._tasks[self.index(key.name)]
-        return self._tasks[key]
-
-    def __iter__(self) -> Iterator[Task]:
-        return iter(self._tasks)
+            return self._slots[self._first_slot(key.name)]  # type: ignore
+        return self._at(key)
 
     def append(self, task: Task) -> None:
-        self._tasks.append(task)
-        self._item_ids.append(task.item.name)
+        self._append(task)
 
     def remove(self, task: Task) -> None:
-        index = self._tasks.index(task)
-        del self._tasks[index]
-        del self._item_ids[index]
+        # 等しいタスクはアイテムの名前も同じなので、同じ名前の中で先頭から探す
+        for slot in self._slots_of(task.item.name):
+            if self._slots[slot] == task:
+                self._remove_slot(slot)
+                return
+        raise ValueError(f"{task!r} is not in list")
 
     def pop(self, index: int) -> Task:
-        task = self._tasks.pop(index)
-        del self._item_ids[index]
-        return task
+        return self._remove_slot(self._slot(index))
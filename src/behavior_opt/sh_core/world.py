@@ -1,8 +1,9 @@
-from copy import deepcopy
-
 import numpy as np
+from numpy.typing import NDArray
 
 from behavior_opt.sh_core.agent import Agent, Agents, Goal
+from behavior_opt.sh_core.compiled_map import CompiledMap
+from behavior_opt.sh_core.distance import distance_matrix, distances_between, distances_to
 from behavior_opt.sh_core.end_point import EndPoints
 from behavior_opt.sh_core.item import Item, Items, ItemSet
 from behavior_opt.sh_core.rack import Rack, Racks
@@ -24,6 +25,10 @@ from behavior_opt.sh_core.typing import (
 )
 
 
+# 距離行列がないときに、エンドポイントからの距離をまとめて求める数
+_DIST_BLOCK_SIZE = 128
+
+
 class World:
     def __init__(
         self,
@@ -31,17 +36,34 @@ class World:
         item_configs: list[ItemConfig],
         agent_configs: list[AgentConfig],
         picking_list: list[PickingTask],
+        compiled_map: CompiledMap | None = None,
     ) -> None:
         self.map_config: MapConfig = MapConfig(**map_config)
+        # アップロード時にコンパイルしたマップ (あれば距離の計算を省く)
+        self.compiled_map = compiled_map
         self.agent_configs: list[AgentConfig] = agent_configs
         self.item_configs: list[ItemConfig] = item_configs
         self.map_height: int = self.map_config["map_height"]
         self.map_width: int = self.map_config["map_width"]
         self.picking_list = picking_list
         self.field_type = FIELD_TYPE
+        # 最初に作ったときのエージェント (2回目以降のresetで戻す)
+        self._initial_agents: list[Agent] | None = None
         self.reset()
 
     def reset(self) -> None:
+        """初期状態に戻す
+
+        最初はconfigから作り、2回目以降はシミュレーションで変わる状態だけを戻す。
+        マップ、距離、アイテム、タスクは最初に作ったものを使い回す。
+        """
+        if self._initial_agents is None:
+            self._build()
+            self._take_snapshot()
+        else:
+            self._restore()
+
+    def _build(self) -> None:
         self.world_map = np.zeros(
             (self.map_config["map_height"], self.map_config["map_width"]), dtype=int
         )
@@ -51,16 +73,43 @@ class World:
         self.racks = Racks([])  # obstacles
         self.store_points: StorePoints = StorePoints([])
         self.end_points: EndPoints = EndPoints([])
+        # 各マスの棚のself.racksでの番号 (棚でなければ-1)
+        self.rack_labels = np.full(
+            (self.map_config["map_height"], self.map_config["map_width"]), -1, dtype=np.int32
+        )
         for w in self.map_config["racks"]:
             self._add_rack(**w)
         self.create_plain_map()
-        for i in self.item_configs:
-            self._add_item(**i)
+        self._add_items(self.item_configs)
         for a in self.agent_configs:
             self._add_agent(**a)
         self._reset_objects()
         self.n_agents = len(self.agents)
 
+    def _take_snapshot(self) -> None:
+        self._initial_agents = list(self.agents)
+        # ストアポイントごとの最初の在庫
+        self._initial_stocks: dict[StorePoint, list[tuple[ItemSet, Amount]]] = {
+            sp: [(item_set, item_set.amount) for item_set in sp.having_items]
+            for sp in self.store_points
+        }
+        # picking, droppingで在庫が変わったストアポイント
+        self._touched_store_points: set[StorePoint] = set()
+
+    def _restore(self) -> None:
+        for sp in self._touched_store_points:
+            stock = self._initial_stocks.get(sp, [])
+            for item_set, amount in stock:
+                item_set.amount = amount
+            sp.having_items = Items([item_set for item_set, _ in stock])
+            sp.is_picked = False
+        self._touched_store_points.clear()
+        assert self._initial_agents is not None, "world is not built"
+        self.agents = Agents(self._initial_agents)
+        self.goals = []
+        self._reset_agents()
+        self.n_agents = len(self.agents)
+
     def picking(self, agent: Agent, item: Item) -> None:
         store_point = item.current_owner
         assert isinstance(
@@ -70,6 +119,7 @@ class World:
         assert (
             store_point.end_point.pos == agent.pos
         ), f"item is different from agent's pos {store_point.end_point.pos} != {agent.pos}"
+        self._touched_store_points.add(store_point)
         taken_out_item = store_point.taken_out(item.name)
         assert taken_out_item is not None, f"item is None. item_id: {item.name}"
         agent.pick_up(taken_out_item)
@@ -84,6 +134,7 @@ class World:
         ), f"item is different from agent's pos {agent.pos} != {store_point.end_point.pos}, task: {task.item.name}"
         drop_off_item = agent.drop_off(item)
         assert drop_off_item is not None, f"item is None. item_id: {item.name}"
+        self._touched_store_points.add(store_point)
         store_point.stored(drop_off_item)
 
     def _reset_objects(self) -> None:
@@ -92,6 +143,7 @@ class World:
         self._reset_racks()
         self._reset_store_points()
         self._reset_end_points()
+        self._reset_distances()
         self._reset_tasks()
 
     def _reset_agents(self) -> None:
@@ -101,10 +153,22 @@ class World:
             self.goals.append(agent.goal)
 
     def _reset_items(self) -> None:
-        for item_id, target_pos, _ in self.picking_list:
-            store_point = self._create_store_point(Position(*target_pos))
-            for item_index in iter(*np.where(np.array(self.items.names) == item_id)):  # type: ignore
-                self.items[int(item_index)].item.ship_target = store_point
+        store_points = self._create_store_points(
+            [Position(*target_pos) for _, target_pos, _ in self.picking_list]
+        )
+        item_sets = list(self.items)
+        item_codes, pick_codes = _factorize(
+            [item_set.item.name for item_set in item_sets],
+            [item_id for item_id, _, _ in self.picking_list],
+        )
+        # 同じアイテムが複数の行にあれば、後の行の出荷先にする
+        last_row = np.full(len(item_sets), -1, dtype=np.int64)
+        rows = np.flatnonzero(pick_codes >= 0)[::-1]
+        codes, first = np.unique(pick_codes[rows], return_index=True)
+        last_row[codes] = rows[first]
+        item_rows = last_row[item_codes]
+        for i in np.flatnonzero(item_rows >= 0).tolist():
+            item_sets[i].item.ship_target = store_points[item_rows[i]]
         self.items.reset()
 
     def _reset_store_points(self) -> None:
@@ -117,21 +181,116 @@ class World:
         for pos in self.end_points.positions:
             self._add_block(1, 1, pos, self.field_type["end_point"])
 
+    def _reset_distances(self) -> None:
+        """エンドポイント間の歩行距離 (棚を避けた最短経路長) を引けるようにし、アイテムを歩行距離で並べ直す
+
+        コンパイル済みのマップがあればエンドポイント間の距離行列をそこから取る。
+        なければ全組の距離行列は作らず、dists_fromで引かれた位置の分だけBFSする
+        (行列はエンドポイントの数の2乗になり、大きな倉庫ではWorldを作るだけで時間がかかる)。
+        """
+        positions = self.end_points.positions
+        self.end_point_ids: dict[Position, int] = {pos: i for i, pos in enumerate(positions)}
+        self._passable = self.plain_map != FIELD_TYPE["rack"]
+        self._neighbors: np.ndarray | None = None
+        # _end_point_dists[i, j]はend_points[i]からend_points[j]までの距離 (コンパイル済みのときだけ)
+        self._end_point_dists: np.ndarray | None = None
+        if self.compiled_map is not None and self.compiled_map.matches(self._passable):
+            self._neighbors = self.compiled_map.neighbors
+            self._end_point_dists = self.compiled_map.distances(positions)
+        # 距離行列から引けない位置 (エージェントの初期位置など) からBFSした距離
+        self._dists_from: dict[Position, np.ndarray] = {}
+        # 4近傍の距離は対称なので、種類の少ない出荷先の側からBFSする
+        self.items.sort(lambda pos, end_point_pos: self.get_dist(end_point_pos, pos))
+
+    def dists_from(self, pos: Position) -> np.ndarray:
+        """posから各エンドポイントまでの歩行距離 (end_pointsの順のuint16、到達できなければUNREACHABLE_DIST)
+
+        初めて引いた位置からはBFSし、結果を覚えておく。
+        """
+        if self._end_point_dists is not None:
+            end_point_id = self.end_point_ids.get(pos)
+            if end_point_id is not None:
+                return self._end_point_dists[end_point_id]
+        dists = self._dists_from.get(pos)
+        if dists is None:
+            positions = self.end_points.positions
+            end_point_id = self.end_point_ids.get(pos)
+            if end_point_id is None:
+                dists = distances_to(self._passable, pos, positions, self._neighbors)
+                self._dists_from[pos] = dists
+                return dists
+            # 1本ずつBFSするより速いので、並びの近いエンドポイントからもまとめてBFSしておく
+            start = end_point_id - end_point_id % _DIST_BLOCK_SIZE
+            block = positions[start : start + _DIST_BLOCK_SIZE]
+            for block_pos, row in zip(block, distances_between(self._passable, block, positions)):
+                self._dists_from[block_pos] = row
+            dists = self._dists_from[pos]
+        return dists
+
+    def get_dist(self, pos: Position, end_point_pos: Position) -> int:
+        """posからエンドポイントend_point_posまでの歩行距離 (到達できなければUNREACHABLE_DIST)"""
+        return int(self.dists_from(pos)[self.end_point_ids[end_point_pos]])
+
+    def end_point_distances(self, end_point_ids: NDArray[np.int64]) -> NDArray[np.uint16]:
+        """end_point_idsの各組の歩行距離 ((n, n)のuint16、distance_matrixと同じ形式)
+
+        節約法のように多くの組を引く場合に、使うエンドポイントの分だけまとめて求める。
+        """
+        if self._end_point_dists is not None:
+            return self._end_point_dists[np.ix_(end_point_ids, end_point_ids)]
+        positions = self.end_points.positions
+        return distance_matrix(self._passable, [positions[i] for i in end_point_ids.tolist()])
+
     def _can_put_end_point(self, pos: Position) -> bool:
         if self._find_rack(pos) is None and self._in_world(pos):
             return True
         return False
 
     def _reset_tasks(self) -> None:
-        tasks: list[Task] = []
-        items = deepcopy(self.items)
-        for item_id, target_pos, amount in self.picking_list:
-            store_point = self.store_points[Position(*target_pos)]
-            for _ in range(amount):
-                item = items.pop(item_id)
-                assert item is not None, f"item is None. item_id: {item_id}"
-                tasks.append(Task(item, store_point))
-        self.tasks = Tasks(tasks)
+        """ピッキングリストの各行のamount個を、同じ名前のアイテムからitemsの順に取ってタスクにする
+
+        タスクはアイテムをコピーせず、在庫のItemとItemSetの中での何個目かだけを持つ。
+        """
+        item_sets = list(self.items)
+        item_codes, pick_codes = _factorize(
+            [item_set.item.name for item_set in item_sets],
+            [item_id for item_id, _, _ in self.picking_list],
+        )
+        amounts = np.array([item_set.amount for item_set in item_sets], dtype=np.int64)
+        pick_amounts = np.array([amount for _, _, amount in self.picking_list], dtype=np.int64)
+        # アイテムを名前の番号ごとにitemsの順で並べ、在庫の1個ずつに通し番号を振る
+        n_codes = int(item_codes.max()) + 1 if len(item_codes) > 0 else 0
+        item_order = np.argsort(item_codes, kind="stable")
+        sorted_amounts = amounts[item_order]
+        stock_end = np.cumsum(sorted_amounts)
+        code_start = (stock_end - sorted_amounts)[
+            np.searchsorted(item_codes[item_order], np.arange(n_codes))
+        ]
+        code_stock = np.bincount(item_codes, weights=amounts, minlength=n_codes).astype(np.int64)
+        # タスク1個ずつの行と、同じ名前のタスクの中での順番
+        unit_rows = np.repeat(np.arange(len(pick_codes)), pick_amounts)
+        unit_codes = pick_codes[unit_rows]
+        order = np.argsort(unit_codes, kind="stable")
+        rank = np.empty(len(unit_rows), dtype=np.int64)
+        rank[order] = np.arange(len(order)) - np.searchsorted(unit_codes[order], unit_codes[order])
+        valid = unit_codes >= 0
+        valid[valid] = rank[valid] < code_stock[unit_codes[valid]]
+        assert (
+            valid.all()
+        ), f"item is None. item_id: {self.picking_list[unit_rows[np.argmin(valid)]][0]}"
+        stock_ids = np.searchsorted(stock_end, code_start[unit_codes] + rank, side="right")
+        unit_items = item_order[stock_ids]
+        # ItemSetの中での何個目か
+        units = code_start[unit_codes] + rank - (stock_end - sorted_amounts)[stock_ids]
+        store_points = [
+            self.store_points[Position(*target_pos)] for _, target_pos, _ in self.picking_list
+        ]
+        self.tasks = Tasks(
+            [
+                Task(item_sets[i].item, store_points[row], unit)
+                for i, row, unit in zip(unit_items.tolist(), unit_rows.tolist(), units.tolist())
+            ]
+        )
 
     def _reset_racks(self) -> None:
         self.racks.reset()
@@ -156,6 +315,10 @@ class World:
         pick_direction: PickDirection = "horizontal",
     ) -> None:
         self._add_block(width, height, Position(*pos), self.field_type["rack"])
+        row, col = pos
+        area = self.rack_labels[row : row + height, col : col + width]
+        # 棚が重なるマスは先に置いた棚のものにする
+        area[area < 0] = len(self.racks)
         self.racks.append(
             Rack(
                 pos=Position(*pos),
@@ -177,6 +340,35 @@ class World:
             name=name, amount=amount, pos=Position(*pos), volume=volume
         )
 
+    def _add_items(self, item_configs: list[ItemConfig]) -> None:
+        """item_configsの順に_add_itemするのと同じ結果を、コレクションへはまとめて足して作る"""
+        positions = [Position(*config["pos"]) for config in item_configs]
+        if len(positions) == 0:
+            return
+        rows, cols = np.array(positions, dtype=np.int64).T
+        # _add_blockのスライスと同じく、マップの外の位置には書かない
+        inside = (0 <= rows) & (rows < self.map_height) & (0 <= cols) & (cols < self.map_width)
+        self.world_map[rows[inside], cols[inside]] = self.field_type["item"]
+        store_points = self._create_store_points(positions)
+        item_sets = [
+            ItemSet(
+                Item(
+                    name=config.get("name", ""),
+                    pos=pos,
+                    volume=config.get("volume", 1),
+                    current_owner=store_point,
+                ),
+                config["amount"],
+            )
+            for config, pos, store_point in zip(item_configs, positions, store_points)
+        ]
+        stocks: dict[StorePoint, list[ItemSet]] = {}
+        for store_point, item_set in zip(store_points, item_sets):
+            stocks.setdefault(store_point, []).append(item_set)
+        for store_point, stock in stocks.items():
+            store_point.having_items.extend(stock)
+        self.items.extend(item_sets)
+
     def _add_store_point_object(
         self, pos: Position, pick_direction: PickDirection = "horizontal"
     ) -> StorePoint:
@@ -221,18 +413,38 @@ class World:
             )
         return store_point
 
+    def _create_store_points(self, positions: list[Position]) -> list[StorePoint]:
+        """positionsの順に_create_store_pointするのと同じ結果 (同じ位置は1回だけ調べる)"""
+        found = {pos: self._find_store_point(pos) for pos in dict.fromkeys(positions)}
+        added = []
+        for pos, store_point in found.items():
+            if store_point is None:
+                rack = self._find_rack(pos)
+                pick_direction = rack.pick_direction if rack else "on"
+                found[pos] = StorePoint(pos=pos, pick_direction=pick_direction)
+                added.append(found[pos])
+        self.store_points.extend(added)
+        return [found[pos] for pos in positions]  # type: ignore
+
     def _find_store_point(self, pos: Position) -> StorePoint | None:
-        for sp in self.store_points:
-            if np.array_equal(sp.pos, pos):  # type: ignore
-                return sp
-        return None
+        return self.store_points.get(pos)
 
     def _find_rack(self, pos: Position) -> Rack | None:
-        for r in self.racks:
-            assert r.pos is not None, "rack's pos is None"
-            if (
-                r.pos.row <= pos.row < r.pos.row + r.height
-                and r.pos.col <= pos.col < r.pos.col + r.width
-            ):
-                return r
-        return None
+        if not self._in_world(pos):
+            return None
+        rack_id = int(self.rack_labels[pos.row, pos.col])
+        if rack_id < 0:
+            return None
+        return self.racks[rack_id]
+
+
+def _factorize(
+    item_names: list[Name], pick_names: list[Name]
+) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    """アイテム名を整数の番号にする (番号はitem_namesでの初出順、itemsにない名前は-1)"""
+    codes: dict[Name, int] = {}
+    for name in item_names:
+        codes.setdefault(name, len(codes))
+    item_codes = np.array([codes[name] for name in item_names], dtype=np.int64)
+    pick_codes = np.array([codes.get(name, -1) for name in pick_names], dtype=np.int64)
+    return item_codes, pick_codes
@@ -5,6 +5,7 @@ from typing import Optional
 
 import numpy as np
 
+from behavior_opt.sh_core.compiled_map import COMPILED_MAP_FILENAME, CompiledMap
 from behavior_opt.sh_core.typing import (
     AgentConfig,
     ItemConfig,
@@ -63,22 +64,7 @@ def read_map_config_csv(map_config_path: Path, config_path: Path) -> MapConfig:
 def read_map_config_json(map_config_path: Path, stock_items_path: Optional[Path]=None) -> MapConfig:
     with open(map_config_path) as f:
         raw_map_config = json.load(f)
-    map_width: Length = raw_map_config["map_width"]
-    map_height: Length = raw_map_config["map_height"]
-    racks: list[RackConfig] = []
-    for rack_config in raw_map_config["racks"]:
-        racks.append(
-            RackConfig(
-                width=rack_config["width"],
-                height=rack_config["height"],
-                # row, col
-                pos=[rack_config["pos"][0], rack_config["pos"][1]],
-                pick_direction=rack_config["pick_direction"],
-            )
-        )
-    map_config: MapConfig = MapConfig(
-        map_width=map_width, map_height=map_height, racks=racks
-    )
+    map_config = parse_map_config_json(raw_map_config)
     if stock_items_path is not None:
         with open(stock_items_path) as f:
             stock_items = json.load(f)
@@ -96,6 +82,33 @@ def read_map_config_json(map_config_path: Path, stock_items_path: Optional[Path]
     return map_config, item_configs
 
 
+def parse_map_config_json(raw_map_config: dict) -> MapConfig:
+    map_width: Length = raw_map_config["map_width"]
+    map_height: Length = raw_map_config["map_height"]
+    racks: list[RackConfig] = []
+    for rack_config in raw_map_config["racks"]:
+        racks.append(
+            RackConfig(
+                width=rack_config["width"],
+                height=rack_config["height"],
+                # row, col
+                pos=[rack_config["pos"][0], rack_config["pos"][1]],
+                pick_direction=rack_config["pick_direction"],
+            )
+        )
+    return MapConfig(
+        map_width=map_width, map_height=map_height, racks=racks
+    )
+
+
+def read_compiled_map(map_config_path: Path) -> CompiledMap | None:
+    """map_config_pathと同じディレクトリにあるコンパイル済みのマップ (なければNone)"""
+    compiled_map_path = map_config_path.parent / COMPILED_MAP_FILENAME
+    if not compiled_map_path.exists():
+        return None
+    return CompiledMap.load(compiled_map_path)
+
+
 def read_picking_list(picking_list_path: Path) -> list[PickingTask]:
     with warnings.catch_warnings():
         # dismiss empty line warning
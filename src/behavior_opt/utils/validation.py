@@ -0,0 +1,190 @@
+import argparse
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from behavior_opt.sh_core.typing import FIELD_TYPE, MapConfig, Position
+from behavior_opt.utils.file_io import read_map_config
+
+# 経路の列は "<agent>_path_row", "<agent>_path_col" (a_star, push-and-swap, mca共通)
+ROW_SUFFIX = "_path_row"
+COL_SUFFIX = "_path_col"
+
+CONFLICT_KINDS = ("out_of_map", "rack", "jump", "vertex", "edge")
+
+
+class Conflict(NamedTuple):
+    """経路上の違反1件
+
+    kind: out_of_map, rack, jump, vertex, edgeのいずれか
+    step: 違反が起きたステップ (jump, edgeは移動元のステップ)
+    agents: 関係するエージェントの列番号
+    pos: 違反が起きたマス (jump, edgeは移動元)
+    """
+
+    kind: str
+    step: int
+    agents: tuple[int, ...]
+    pos: Position
+
+
+def read_trajectory(csv_path: Path) -> tuple[list[str], NDArray[np.int32]]:
+    """output.csvから(エージェント名, (T, N, 2)の経路)を読み込む"""
+    with open(csv_path) as f:
+        header = f.readline().strip().split(",")
+    row_cols = [i for i, name in enumerate(header) if name.endswith(ROW_SUFFIX)]
+    col_cols = [header.index(header[i][: -len(ROW_SUFFIX)] + COL_SUFFIX) for i in row_cols]
+    names = [header[i][: -len(ROW_SUFFIX)] for i in row_cols]
+    usecols = [i for pair in zip(row_cols, col_cols) for i in pair]
+    values = np.loadtxt(
+        csv_path, dtype=np.int32, delimiter=",", skiprows=1, usecols=usecols, ndmin=2
+    )
+    return names, values.reshape(len(values), len(names), 2)
+
+
+def map_from_config(map_config: MapConfig) -> NDArray[np.int_]:
+    """棚だけを置いたマップを作る (World.plain_mapの棚と同じ値)"""
+    map_ = np.full(
+        (map_config["map_height"], map_config["map_width"]),
+        FIELD_TYPE["empty"],
+        dtype=int,
+    )
+    for rack in map_config["racks"]:
+        row, col = rack["pos"]
+        map_[row : row + rack["height"], col : col + rack["width"]] = FIELD_TYPE["rack"]
+    return map_
+
+
+def _collisions(
+    kind: str, keys: NDArray[np.int64], trajectory: NDArray[np.int32]
+) -> list[Conflict]:
+    """各ステップ (行) で同じkeyを持つエージェントをまとめる
+
+    行ごとに並べ替えて重複のある行だけを絞り込み、該当行だけを詳しく調べる。
+    """
+    sorted_keys = np.sort(keys, axis=1)
+    steps = np.flatnonzero((sorted_keys[:, 1:] == sorted_keys[:, :-1]).any(axis=1))
+    conflicts = []
+    for step in steps.tolist():
+        groups: dict[int, list[int]] = {}
+        for agent, key in enumerate(keys[step].tolist()):
+            groups.setdefault(key, []).append(agent)
+        for agents in groups.values():
+            if len(agents) >= 2:
+                pos = Position(*trajectory[step, agents[0]].tolist())
+                conflicts.append(Conflict(kind, step, tuple(agents), pos))
+    return conflicts
+
+
+def find_conflicts(
+    trajectory: NDArray[np.integer],
+    plain_map: Optional[NDArray[np.integer]] = None,
+    map_shape: Optional[tuple[int, int]] = None,
+) -> list[Conflict]:
+    """(T, N, 2)の経路の違反をすべて返す
+
+    - out_of_map: マップの外にいる (plain_mapかmap_shapeを指定した場合)
+    - rack: 棚の上にいる (plain_mapを指定した場合)
+    - jump: 1ステップで上下左右の隣以外へ移動している
+    - vertex: 同じステップに複数のエージェントが同じマスにいる
+    - edge: 隣り合う2台が1ステップで位置を入れ替えている
+    結果はステップ順に並ぶ。
+    """
+    trajectory = np.asarray(trajectory, dtype=np.int32)
+    assert trajectory.ndim == 3 and trajectory.shape[2] == 2, trajectory.shape
+    n_steps, n_agents, _ = trajectory.shape
+    if plain_map is not None:
+        map_shape = plain_map.shape  # type: ignore
+    conflicts: list[Conflict] = []
+    if n_steps == 0 or n_agents == 0:
+        return conflicts
+    rows, cols = trajectory[..., 0], trajectory[..., 1]
+
+    inside = np.ones((n_steps, n_agents), dtype=bool)
+    if map_shape is not None:
+        height, width = map_shape
+        inside = (0 <= rows) & (rows < height) & (0 <= cols) & (cols < width)
+        for step, agent in np.argwhere(~inside).tolist():
+            pos = Position(*trajectory[step, agent].tolist())
+            conflicts.append(Conflict("out_of_map", step, (agent,), pos))
+    if plain_map is not None:
+        on_rack = np.zeros((n_steps, n_agents), dtype=bool)
+        on_rack[inside] = plain_map[rows[inside], cols[inside]] == FIELD_TYPE["rack"]
+        for step, agent in np.argwhere(on_rack).tolist():
+            pos = Position(*trajectory[step, agent].tolist())
+            conflicts.append(Conflict("rack", step, (agent,), pos))
+
+    moves = np.abs(np.diff(rows, axis=0)) + np.abs(np.diff(cols, axis=0))
+    for step, agent in np.argwhere(moves > 1).tolist():
+        pos = Position(*trajectory[step, agent].tolist())
+        conflicts.append(Conflict("jump", step, (agent,), pos))
+
+    # マップの外の座標も区別できるように、座標の範囲からセル番号を振る
+    row_min, col_min = int(rows.min()), int(cols.min())
+    width = int(cols.max()) - col_min + 1
+    n_cells = (int(rows.max()) - row_min + 1) * width
+    cells = (rows.astype(np.int64) - row_min) * width + (cols - col_min)
+    conflicts += _collisions("vertex", cells, trajectory)
+
+    # 1マス移動した辺を向きに関係なく番号付けし、同じステップで同じ辺を通る2台を探す
+    # (同じ向きに通る場合は移動元でvertexになるので、残るのは入れ替わりだけ)
+    # 止まっている・跳んだエージェントには重ならない負の番号を振る
+    src, dst = cells[:-1], cells[1:]
+    edges = np.minimum(src, dst) * n_cells + np.maximum(src, dst)
+    edges[moves != 1] = -1 - np.nonzero(moves != 1)[1]
+    for conflict in _collisions("edge", edges, trajectory):
+        if len(set(src[conflict.step, list(conflict.agents)].tolist())) > 1:
+            conflicts.append(conflict)
+
+    conflicts.sort(key=lambda c: (c.step, CONFLICT_KINDS.index(c.kind), c.agents))
+    return conflicts
+
+
+def check_trajectory(
+    trajectory: NDArray[np.integer],
+    plain_map: Optional[NDArray[np.integer]] = None,
+    map_shape: Optional[tuple[int, int]] = None,
+) -> None:
+    """違反があればAssertionErrorを送出する"""
+    conflicts = find_conflicts(trajectory, plain_map, map_shape)
+    assert len(conflicts) == 0, f"{len(conflicts)} conflicts: {conflicts[:5]}"
+
+
+def summarize(conflicts: list[Conflict]) -> dict[str, int]:
+    """違反の種類ごとの件数"""
+    counts = {kind: 0 for kind in CONFLICT_KINDS}
+    for conflict in conflicts:
+        counts[conflict.kind] += 1
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="validation.py")
+    parser.add_argument("output_csv", type=Path)
+    parser.add_argument("-m", "--map-config-path", required=False, type=Path)
+    parser.add_argument("-s", "--stock-items-path", required=False, type=Path)
+    parser.add_argument("-c", "--config-path", required=False, type=Path)
+    parser.add_argument("-n", "--max-print", default=20, type=int)
+    args = parser.parse_args()
+    output_csv: Path = args.output_csv
+    map_config_path: Optional[Path] = args.map_config_path
+    stock_items_path: Optional[Path] = args.stock_items_path
+    config_path: Optional[Path] = args.config_path
+    max_print: int = args.max_print
+
+    plain_map = None
+    if map_config_path is not None:
+        map_config = read_map_config(map_config_path, stock_items_path, config_path)
+        if map_config_path.suffix == ".json":
+            map_config, _ = map_config
+        plain_map = map_from_config(map_config)
+    names, trajectory = read_trajectory(output_csv)
+    conflicts = find_conflicts(trajectory, plain_map)
+    print(f"steps:{len(trajectory)} agents:{len(names)}")
+    for kind, count in summarize(conflicts).items():
+        print(f"{kind}:{count}")
+    for conflict in conflicts[:max_print]:
+        agent_names = ",".join(names[i] for i in conflict.agents)
+        print(f"{conflict.kind} step:{conflict.step} agents:{agent_names} pos:{tuple(conflict.pos)}")
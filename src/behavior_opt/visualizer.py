@@ -7,12 +7,13 @@ from pathlib import Path
 import numpy as np
 from PIL import Image
 
-from behavior_opt.sh_core import AgentConfig, MapConfig, Position
+from behavior_opt.sh_core import AgentConfig, CompiledMap, MapConfig, Position
 from behavior_opt.sh_core.typing import ItemConfig, Name, PickingTask
 from behavior_opt.sh_core.world import World
 from behavior_opt.storehouse import raw_env
 from behavior_opt.utils.file_io import (
     read_agent_config,
+    read_compiled_map,
     read_item_config,
     read_map_config,
     read_picking_list,
@@ -53,12 +54,14 @@ def create_image(
     item_configs: list[ItemConfig],
     behavior_opt_output: list[dict[str, deque[Position] | deque[Name]]],
     output_gif_path: Path,
+    compiled_map: CompiledMap | None = None,
 ) -> None:
     world = World(
         map_config=map_config,
         item_configs=item_configs,
         picking_list=picking_list,
         agent_configs=agent_configs,
+        compiled_map=compiled_map,
     )
     env = raw_env(world=world, output_list=behavior_opt_output)
     env.reset()
@@ -108,6 +111,7 @@ def visualizer(
             item_configs=item_config,
             behavior_opt_output=behavior_opt_output,
             output_gif_path=output_gif_path,
+            compiled_map=read_compiled_map(map_config_path),
         )
 
 
@@ -0,0 +1,104 @@
+"""Worldのメモリ使用量を測る
+
+合成した倉庫 (棚, 在庫, ピッキングリスト) でWorldを作り、tracemallocで測った確保量を表示する。
+
+    cd src && python -m benchmarks.benchmark_memory --n-items 100000 --n-picks 100000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+from behavior_opt.sh_core import World
+from behavior_opt.sh_core.typing import AgentConfig, ItemConfig, MapConfig, PickingTask
+
+
+def synthetic_configs(
+    n_racks: int, n_items: int, n_picks: int, n_agents: int, amount: int
+) -> tuple[MapConfig, list[ItemConfig], list[AgentConfig], list[PickingTask]]:
+    """棚を格子状に並べ、在庫を棚のマスに順に置き、各ピッキング行でamount個ずつ出荷する"""
+    n_cols = max(int(n_racks**0.5), 1)
+    n_rows = -(-n_racks // n_cols)
+    # 棚 (1x2) の間は1マスずつ空け、下端を出荷先の通路にする
+    map_config = MapConfig(
+        map_height=n_rows * 2 + 2,
+        map_width=n_cols * 3 + 1,
+        racks=[
+            {
+                "pos": [1 + 2 * (i // n_cols), 1 + 3 * (i % n_cols)],
+                "width": 2,
+                "height": 1,
+                "pick_direction": "vertical",
+            }
+            for i in range(n_racks)
+        ],
+    )
+    item_configs = []
+    for i in range(n_items):
+        rack = map_config["racks"][i % n_racks]
+        row, col = rack["pos"]
+        item_configs.append(
+            {
+                "name": f"item_{i}",
+                "pos": [row, col + (i // n_racks) % 2],
+                "amount": amount,
+                "volume": 1,
+            }
+        )
+    ship_pos = [map_config["map_height"] - 1, 0]
+    picking_list = [
+        PickingTask(f"item_{i % n_items}", ship_pos, amount // max(-(-n_picks // n_items), 1))
+        for i in range(n_picks)
+    ]
+    agent_configs = [
+        {
+            "name": f"agent_{i}",
+            "pos": [map_config["map_height"] - 1, i % map_config["map_width"]],
+            "capacity": 10,
+        }
+        for i in range(n_agents)
+    ]
+    return map_config, item_configs, agent_configs, picking_list
+
+
+def object_size(obj: object) -> int:
+    """objの大きさ (__dict__があればその分も含む)"""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def main(args: argparse.Namespace) -> None:
+    configs = synthetic_configs(
+        args.n_racks, args.n_items, args.n_picks, args.n_agents, args.amount
+    )
+    tracemalloc.start()
+    start = time.perf_counter()
+    world = World(*configs)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"racks: {len(world.racks)}, items: {len(world.items)}, tasks: {len(world.tasks)}")
+    print(f"build: {elapsed:.2f}s")
+    print(f"memory: {current / 2**20:.1f} MiB (peak {peak / 2**20:.1f} MiB)")
+    task = world.tasks[0]
+    for name, obj in (
+        ("Item", task.item),
+        ("ItemSet", world.items[0]),
+        ("StorePoint", task.target_store_point),
+        ("Agent", world.agents[0]),
+        ("Task", task),
+    ):
+        print(f"{name}: {object_size(obj)} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.benchmark_memory")
+    parser.add_argument("--n-racks", type=int, default=500)
+    parser.add_argument("--n-items", type=int, default=100000)
+    parser.add_argument("--n-picks", type=int, default=100000)
+    parser.add_argument("--n-agents", type=int, default=100)
+    parser.add_argument("--amount", type=int, default=3, help="在庫1行あたりの個数")
+    main(parser.parse_args())
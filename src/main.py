@@ -20,6 +20,8 @@ from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 from mfutils import parse_log, parse_route, get_jst_now
 from stock_management import generate_rack_layout
+from behavior_opt.sh_core import COMPILED_MAP_FILENAME, CompiledMap
+from behavior_opt.utils.file_io import parse_map_config_json
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -415,17 +417,23 @@ async def upload_map_config(
         next_number = get_next_number(map_dir)
 
         target_dir = map_dir / next_number
-        target_dir.mkdir()
         try:
             json_data = json.load(file.file)
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON file")
-        
+
+        # 実行のたびにマップから距離などを計算し直さないよう、アップロード時にコンパイルしておく
+        # (コンパイルできないマップで書きかけのディレクトリを残さないよう、ディレクトリを作る前に行う)
+        compiled_map = CompiledMap.compile(parse_map_config_json(json_data))
+
+        target_dir.mkdir()
         generate_rack_layout(json_data, target_dir)
         
         file_path = target_dir / "config.json"
         with open(file_path, "w") as f:
             json.dump(json_data, f, indent=4)
+
+        compiled_map.save(target_dir / COMPILED_MAP_FILENAME)
         
         meta_info = {
             "id": next_number,